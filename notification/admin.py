@@ -1,11 +1,11 @@
 from __future__ import absolute_import, unicode_literals
 from django.contrib import admin
 
-from notification.models import NoticeType, NoticeSetting, Notice, ObservedItem, NoticeQueueBatch, QueryData
+from notification.models import NoticeType, NoticeSetting, Notice, ObservedItem, ObserverCount, NoticeQueueBatch, QueryData, DigestItem
 
 
 class NoticeTypeAdmin(admin.ModelAdmin):
-    list_display = ["label", "display", "description", "default", ]
+    list_display = ["label", "display", "description", "default", "coalesce_window", "priority", ]
     search_fields = ["label", "display", "description", ]
 
 
@@ -19,7 +19,7 @@ class NoticeSettingAdmin(admin.ModelAdmin):
 
 class NoticeAdmin(admin.ModelAdmin):
     list_display = ["message", "recipient", "sender", "notice_type",
-                    "added", "unseen", "archived", ]
+                    "added", "count", "unseen", "archived", ]
     search_fields = ['recipient__username', 'recipient__email', ]
     raw_id_fields = ["recipient", "sender", ]
 
@@ -32,13 +32,31 @@ class ObservedItemAdmin(admin.ModelAdmin):
     raw_id_fields = ["user", ]
 
 
+class ObserverCountAdmin(admin.ModelAdmin):
+    list_display = ["pk", "content_type", "object_id", "signal", "count", ]
+    list_filter = ["content_type", "signal", ]
+
+
+class DigestItemAdmin(admin.ModelAdmin):
+    list_display = ["pk", "user", "medium", "notice_type", "added", ]
+    list_filter = ["medium", "notice_type", ]
+    search_fields = ['user__username', 'user__email', ]
+    raw_id_fields = ["user", ]
+
+
 class QueryDataAdmin(admin.ModelAdmin):
     list_display = ["pk", "handler", "hash", "data"]
     list_filter = ["handler", ]
 
-admin.site.register(NoticeQueueBatch)
+class NoticeQueueBatchAdmin(admin.ModelAdmin):
+    list_display = ["pk", "priority", "expires", ]
+    list_filter = ["priority", ]
+
+admin.site.register(NoticeQueueBatch, NoticeQueueBatchAdmin)
 admin.site.register(NoticeType, NoticeTypeAdmin)
 admin.site.register(NoticeSetting, NoticeSettingAdmin)
 admin.site.register(Notice, NoticeAdmin)
 admin.site.register(ObservedItem, ObservedItemAdmin)
+admin.site.register(ObserverCount, ObserverCountAdmin)
 admin.site.register(QueryData, QueryDataAdmin)
+admin.site.register(DigestItem, DigestItemAdmin)
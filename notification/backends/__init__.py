@@ -1,11 +1,16 @@
 from __future__ import absolute_import, unicode_literals
 
 import sys
+import threading
+try:
+    from collections.abc import Mapping
+except ImportError:  # Python 2.*
+    from collections import Mapping
 
 from django.conf import settings
 from django.core import exceptions
 
-from .base import BaseBackend
+from .base import BaseBackend, RecordingContext, shared_rendering
 
 # mostly for backend compatibility
 DEFAULT_BACKENDS = {
@@ -13,8 +18,13 @@ DEFAULT_BACKENDS = {
     "1": ("email", "notification.backends.email.EmailBackend"),
 }
 
-def load_backends():
-    backends = []
+def get_backend_specs():
+    """
+    Returns a list of (medium_id, label, backend_path, spam_sensitivity)
+    tuples from the NOTIFICATION_BACKENDS setting, without importing
+    the backends.
+    """
+    specs = []
     for medium_id, bits in getattr(settings, "NOTIFICATION_BACKENDS", DEFAULT_BACKENDS).items():
         if len(bits) == 2:
             label, backend_path = bits
@@ -23,6 +33,18 @@ def load_backends():
             label, backend_path, spam_sensitivity = bits
         else:
             raise exceptions.ImproperlyConfigured("NOTIFICATION_BACKENDS does not contain enough data.")
+        specs.append((medium_id, label, backend_path, spam_sensitivity))
+    return specs
+
+
+def get_notice_media():
+    """Returns the (medium_id, label) pairs of the configured backends."""
+    return [(medium_id, label) for medium_id, label, _, _ in get_backend_specs()]
+
+
+def load_backends():
+    backends = []
+    for medium_id, label, backend_path, spam_sensitivity in get_backend_specs():
         dot = backend_path.rindex(".")
         backend_mod, backend_class = backend_path[:dot], backend_path[dot+1:]
         try:
@@ -36,3 +58,42 @@ def load_backends():
         backend_instance = getattr(mod, backend_class)(medium_id, spam_sensitivity)
         backends.append(((medium_id, label), backend_instance))
     return dict(backends)
+
+
+class LazyMapping(Mapping):
+    """
+    A read-only mapping built by calling loader on first access.
+
+    Used for the backend registry, so that importing notification.models
+    does not import and instantiate every backend.
+    """
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._data = None
+
+    def _get_data(self):
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    self._data = self._loader()
+        return self._data
+
+    @property
+    def is_loaded(self):
+        return self._data is not None
+
+    def __getitem__(self, key):
+        return self._get_data()[key]
+
+    def __iter__(self):
+        return iter(self._get_data())
+
+    def __len__(self):
+        return len(self._get_data())
+
+    def __repr__(self):
+        if self._data is None:
+            return "<{0}: not loaded>".format(self.__class__.__name__)
+        return repr(self._data)
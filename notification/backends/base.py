@@ -1,5 +1,88 @@
 from __future__ import absolute_import, unicode_literals
+import logging
+import threading
+import uuid
+from contextlib import contextmanager
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.template import Context
 from django.template.loader import render_to_string
+from django.utils.safestring import SafeData, mark_safe
+
+# context variables which differ between the recipients of a notice
+RECIPIENT_KEYS = frozenset(("user", "recipient", "unsubscribe_url", "unsubscribe_all_url"))
+
+# delimits the placeholders of RecordingContext in rendered outputs
+PLACEHOLDER_MARK = uuid.uuid4().hex[:12]
+
+_rendering = threading.local()
+
+logger = logging.getLogger(__name__)
+
+
+class RecordingContext(Context):
+    """
+    A template Context recording the names of the variables looked up,
+    to know if a rendered output depends on the recipient.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingContext, self).__init__(*args, **kwargs)
+        self.accessed = set()
+        self.placeholder_keys = set()
+        self.placeholders = {}
+
+    def set_placeholder(self, key, value):
+        """
+        Sets key to a token standing for value, so that the outputs reading
+        key can still be shared between recipients. fill_placeholders()
+        replaces the tokens afterwards. value must be left unchanged by
+        escaping, like an URL.
+        """
+        token = "{0}{1}{0}".format(PLACEHOLDER_MARK, key)
+        self[key] = token
+        self.placeholder_keys.add(key)
+        self.placeholders[token] = value
+
+    def fill_placeholders(self, text):
+        """Returns text with the placeholder tokens replaced by their values."""
+        filled = text
+        for token, value in self.placeholders.items():
+            filled = filled.replace(token, value)
+        if isinstance(text, SafeData):
+            return mark_safe(filled)
+        return filled
+
+    def __getitem__(self, key):
+        self.accessed.add(key)
+        return super(RecordingContext, self).__getitem__(key)
+
+    def __contains__(self, key):
+        self.accessed.add(key)
+        return super(RecordingContext, self).__contains__(key)
+
+    def has_key(self, key):
+        self.accessed.add(key)
+        return super(RecordingContext, self).has_key(key)
+
+    def get(self, key, otherwise=None):
+        self.accessed.add(key)
+        return super(RecordingContext, self).get(key, otherwise)
+
+
+@contextmanager
+def shared_rendering():
+    """
+    Within this block, BaseBackend.render() outputs which do not depend on
+    the recipient are rendered once and shared. The block must cover
+    recipients of the same notice, language and timezone only.
+    """
+    previous = getattr(_rendering, "cache", None)
+    _rendering.cache = {}
+    try:
+        yield
+    finally:
+        _rendering.cache = previous
 
 
 class BaseBackend(object):
@@ -20,12 +103,74 @@ class BaseBackend(object):
         if should_send(user, notice_type, self.medium_id):
             return True
         return False
+
+    def can_send_many(self, users, notice_type):
+        """
+        Returns the users, among the given ones, to whom this backend is
+        allowed to send a notification of notice_type.
+        """
+        if type(self).can_send != BaseBackend.can_send:
+            # can_send() is customized, honour it.
+            return [user for user in users if self.can_send(user, notice_type)]
+        return self.filter_by_settings(users, notice_type)
+
+    def filter_by_settings(self, users, notice_type):
+        """
+        Returns the users whose notice settings allow this backend,
+        reading the settings with a query per batch instead of per user.
+        """
+        from notification.models import should_send_many
+        allowed = should_send_many(users, notice_type, self.medium_id)
+        return [user for user in users if allowed[user.pk]]
     
-    def deliver(self, recipient, notice_type, extra_context):
+    def deliver(self, recipient, sender, notice_type, extra_context):
         """
         Deliver a notification to the given recipient.
         """
-        raise NotImplemented()
+        raise NotImplementedError()
+
+    def deliver_many(self, recipients, sender, notice_type, extra_context):
+        """
+        Deliver a notification to each of the given recipients, sharing
+        the same extra_context. Returns a list of (recipient, delivered)
+        pairs; a recipient is not delivered if deliver() returns False or
+        raises ObjectDoesNotExist, so that the others are still delivered.
+
+        Backends able to send in bulk (one query, one connection) should
+        override this method.
+        """
+        results = []
+        with shared_rendering():
+            for recipient in recipients:
+                try:
+                    result = self.deliver(recipient, sender, notice_type, extra_context)
+                except ObjectDoesNotExist as e:
+                    logger.warning("Can't to deliver notice {0} to user {1} since {2}".format(
+                        notice_type.label, recipient, e))
+                    result = False
+                results.append((recipient, result is not False))
+        return results
+
+    def render(self, template_name, dictionary, context):
+        """
+        Renders like render_to_string(). Inside shared_rendering(), if context
+        is a RecordingContext, an output which does not read any of
+        RECIPIENT_KEYS, except the placeholders of the context, is reused for
+        the next recipients. The output keeps the placeholder tokens.
+        """
+        cache = getattr(_rendering, "cache", None)
+        if cache is None or not isinstance(context, RecordingContext):
+            return render_to_string(template_name, dictionary, context_instance=context)
+        if isinstance(template_name, (list, tuple)):
+            template_name = tuple(template_name)
+        key = (template_name, tuple(sorted((dictionary or {}).items())), context.autoescape)
+        if key in cache:
+            return cache[key]
+        context.accessed = set()
+        output = render_to_string(template_name, dictionary, context_instance=context)
+        if not context.accessed & RECIPIENT_KEYS - context.placeholder_keys:
+            cache[key] = output
+        return output
     
     def get_formatted_messages(self, formats, label, context):
         """
@@ -37,7 +182,7 @@ class BaseBackend(object):
             # conditionally turn off autoescaping for .txt extensions in format
             if format.endswith(".txt"):
                 context.autoescape = False
-            format_templates[format] = render_to_string((
+            format_templates[format] = self.render((
                 "notification/{0}/{1}".format(label, format),
-                "notification/{0}".format(format)), context_instance=context)
+                "notification/{0}".format(format)), None, context)
         return format_templates
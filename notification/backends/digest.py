@@ -0,0 +1,171 @@
+from __future__ import absolute_import, unicode_literals
+import logging
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core import urlresolvers
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Min
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils import translation
+
+from notification import backends
+from notification.backends.email import EmailBackend, DEFAULT_HTTP_PROTOCOL
+from notification.lockfile import FileLock, AlreadyLocked, LockTimeout
+
+try:
+    str = unicode  # Python 2.* compatible
+except NameError:
+    pass
+
+# seconds between two digests of a user
+DIGEST_PERIOD = getattr(settings, "NOTIFICATION_DIGEST_PERIOD", 3600)
+# how long to wait for the lock of a previous run, as for emit_notices
+LOCK_WAIT_TIMEOUT = getattr(settings, "NOTIFICATION_LOCK_WAIT_TIMEOUT", -1)
+
+logger = logging.getLogger(__name__)
+
+
+class DigestBackend(EmailBackend):
+    """
+    Buffers the notices of a user in DigestItem, and sends them in a single
+    email once per NOTIFICATION_DIGEST_PERIOD (see the emit_digests command).
+    """
+    # higher than the default of any notice type: off by default, users
+    # opt in per notice type, which turns the email medium off for it
+    spam_sensitivity = 1000
+
+    def deliver(self, recipient, sender, notice_type, extra_context):
+        self.build_item(recipient, sender, notice_type, extra_context).save()
+
+    def deliver_many(self, recipients, sender, notice_type, extra_context):
+        if type(self).deliver != DigestBackend.deliver:
+            # deliver() is customized, honour it.
+            return super(DigestBackend, self).deliver_many(recipients, sender, notice_type, extra_context)
+        from notification.models import DigestItem
+        with backends.shared_rendering():
+            items = [
+                self.build_item(recipient, sender, notice_type, extra_context)
+                for recipient in recipients
+            ]
+        DigestItem.objects.bulk_create(items)
+        return [(recipient, True) for recipient in recipients]
+
+    def build_item(self, recipient, sender, notice_type, extra_context):
+        """Returns an unsaved DigestItem for the recipient."""
+        from notification.models import DigestItem
+        context = self.get_context(recipient, sender, notice_type, extra_context)
+        messages = self.get_formatted_messages((
+            "full.txt",
+        ), notice_type.label, context)
+        return DigestItem(
+            user=recipient,
+            medium=self.medium_id,
+            notice_type=notice_type,
+            message=context.fill_placeholders(messages["full.txt"]),
+        )
+
+
+def send_digests(now=None, batch_size=100):
+    """
+    Sends a digest email per user and medium whose oldest buffered notice
+    is older than NOTIFICATION_DIGEST_PERIOD. Returns the number of emails
+    sent, 0 if another run holds the lock.
+    """
+    # Two overlapping runs would send the same buffered notices.
+    lock = FileLock("send_digests")
+    logger.debug("acquiring lock...")
+    try:
+        lock.acquire(LOCK_WAIT_TIMEOUT)
+    except AlreadyLocked:
+        logger.debug("lock already in place. quitting.")
+        return 0
+    except LockTimeout:
+        logger.debug("waiting for the lock timed out. quitting.")
+        return 0
+    logger.debug("acquired.")
+    try:
+        return _send_due_digests(now, batch_size)
+    finally:
+        logger.debug("releasing lock...")
+        lock.release()
+        logger.debug("released.")
+
+
+def _send_due_digests(now, batch_size):
+    from notification.models import (NOTIFICATION_BACKENDS, DigestItem,
+        LanguageStoreNotAvailable, get_notification_languages, _chunked)
+    if now is None:
+        now = timezone.now()
+    digest_backends = dict(
+        (medium_id, backend)
+        for (medium_id, backend_label), backend in NOTIFICATION_BACKENDS.items()
+        if isinstance(backend, DigestBackend)
+    )
+    due = DigestItem.objects.filter(
+        medium__in=list(digest_backends), added__lte=now
+    ).values_list("user", "medium").annotate(
+        first_added=Min("added")
+    ).filter(first_added__lte=now - timedelta(seconds=DIGEST_PERIOD)).order_by()
+
+    current_site = Site.objects.get_current()
+    root_url = "{0}://{1}".format(DEFAULT_HTTP_PROTOCOL, str(current_site))
+    context = {
+        "current_site": current_site,
+        "notices_url": "{0}{1}".format(root_url, urlresolvers.reverse("notification_notices")),
+        "settings_url": "{0}{1}".format(root_url, urlresolvers.reverse("notification_notice_settings")),
+    }
+    current_language = translation.get_language()
+    current_timezone = timezone.get_current_timezone()
+
+    sent = 0
+    for part in _chunked(list(due), batch_size):
+        keys = set((user_id, medium) for user_id, medium, first_added in part)
+        digests = OrderedDict()
+        items = DigestItem.objects.filter(
+            user__in=set(user_id for user_id, medium in keys), added__lte=now
+        ).select_related("user", "notice_type").order_by("pk")
+        for item in items:
+            if (item.user_id, item.medium) in keys:
+                digests.setdefault((item.user_id, item.medium), []).append(item)
+
+        try:
+            languages = get_notification_languages(user_items[0].user for user_items in digests.values())
+        except LanguageStoreNotAvailable:
+            languages = {}
+
+        emails = []
+        for (user_id, medium), user_items in digests.items():
+            user = user_items[0].user
+            if not digest_backends[medium].has_email(user):
+                continue
+            language, tz = languages.get(user_id, (None, None))
+            with translation.override(language or current_language), \
+                    timezone.override(tz or current_timezone):
+                user_context = dict(context, user=user, recipient=user, items=user_items)
+                subject = "".join(render_to_string(
+                    "notification/digest_subject.txt", user_context
+                ).splitlines())
+                body = render_to_string("notification/digest_body.txt", user_context)
+            emails.append((subject, body, user.email))
+
+        if 'mailer' in settings.INSTALLED_APPS:
+            from mailer import send_mail
+            for subject, body, email in emails:
+                send_mail(subject, body, settings.DEFAULT_FROM_EMAIL, [email])
+        elif emails:
+            # one connection for the whole batch
+            connection = get_connection()
+            connection.send_messages([
+                EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, [email], connection=connection)
+                for subject, body, email in emails
+            ])
+        sent += len(emails)
+
+        DigestItem.objects.filter(
+            pk__in=[item.pk for user_items in digests.values() for item in user_items]
+        ).delete()
+    return sent
@@ -3,8 +3,8 @@ from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core import urlresolvers
 from django.core import signing
+from django.core.cache import cache
 from django.db.models.loading import get_app
-from django.template import Context
 from django.template.loader import render_to_string
 from django.utils.translation import ugettext
 from django.core.exceptions import ImproperlyConfigured
@@ -33,11 +33,46 @@ class EmailBackend(backends.BaseBackend):
 
     def can_send(self, user, notice_type):
         can_send = super(EmailBackend, self).can_send(user, notice_type)
-        if can_send and user.email and '@' in user.email and not user.email.startswith('__'):
-            return True
+        if can_send and self.has_email(user):
+            return bool(self.exclude_digests([user], notice_type))
         return False
 
-    def deliver(self, recipient, sender, notice_type, extra_context):
+    def can_send_many(self, users, notice_type):
+        if type(self).can_send != EmailBackend.can_send:
+            return super(EmailBackend, self).can_send_many(users, notice_type)
+        users = self.filter_by_settings([user for user in users if self.has_email(user)], notice_type)
+        return self.exclude_digests(users, notice_type)
+
+    def get_digest_media(self):
+        """Returns the medium ids of the digest backends, which replace this one."""
+        from notification.backends.digest import DigestBackend
+        from notification.models import NOTIFICATION_BACKENDS
+        if isinstance(self, DigestBackend):
+            return []
+        return [
+            medium_id
+            for (medium_id, backend_label), backend in NOTIFICATION_BACKENDS.items()
+            if isinstance(backend, DigestBackend)
+        ]
+
+    def exclude_digests(self, users, notice_type):
+        """
+        Returns the users who did not choose to receive the notices of
+        notice_type in a digest instead of immediately.
+        """
+        from notification.models import should_send_many
+        for medium_id in self.get_digest_media():
+            if not users:
+                break
+            digest = should_send_many(users, notice_type, medium_id)
+            users = [user for user in users if not digest[user.pk]]
+        return users
+
+    def has_email(self, user):
+        return bool(user.email and '@' in user.email and not user.email.startswith('__'))
+
+    def get_context(self, recipient, sender, notice_type, extra_context):
+        """Returns the template context of a notice for the recipient."""
         # TODO: require this to be passed in extra_context
         current_site = Site.objects.get_current()
         root_url = "{0}://{1}".format(
@@ -68,7 +103,7 @@ class EmailBackend(backends.BaseBackend):
         )
 
         # update context with user specific translations
-        context = Context({
+        context = backends.RecordingContext({
             "user": recipient,  # Old compatible
             "recipient": recipient,
             "sender": sender,
@@ -76,11 +111,31 @@ class EmailBackend(backends.BaseBackend):
             "notice_type": notice_type,
             "notices_url": notices_url,
             "settings_url": settings_url,
-            "unsubscribe_url": unsubscribe_url,
-            "unsubscribe_all_url": unsubscribe_all_url,
             "current_site": current_site,
         })
+        # Filled in the shared outputs per recipient.
+        context.set_placeholder("unsubscribe_url", unsubscribe_url)
+        context.set_placeholder("unsubscribe_all_url", unsubscribe_all_url)
         context.update(extra_context)
+        return context
+
+    def is_coalesced(self, recipient, notice_type, extra_context):
+        """
+        Returns True if an email of notice_type about the same object was
+        sent to recipient within the coalesce window of notice_type.
+        """
+        from notification.models import get_coalesce_key
+        key = get_coalesce_key(recipient, notice_type, extra_context)
+        if key is None:
+            return False
+        # add() is atomic on shared caches, only the first email passes
+        cache_key = "notification.coalesce.{0}.{1}".format(self.medium_id, key)
+        return not cache.add(cache_key, 1, notice_type.coalesce_window)
+
+    def deliver(self, recipient, sender, notice_type, extra_context):
+        if self.is_coalesced(recipient, notice_type, extra_context):
+            return False
+        context = self.get_context(recipient, sender, notice_type, extra_context)
 
         messages = self.get_formatted_messages((
             "short.txt",
@@ -96,18 +151,24 @@ class EmailBackend(backends.BaseBackend):
         else:
             is_html = False
 
-        subject = "".join(render_to_string("notification/email_subject.txt", {
+        subject = "".join(self.render("notification/email_subject.txt", {
             "message": messages["short.txt"],
         }, context).splitlines())
 
-        body = render_to_string("notification/email_body.txt", {
+        body = self.render("notification/email_body.txt", {
             "message": messages["full.txt"],
         }, context)
 
-        body_html = render_to_string("notification/email_body.html", {
+        body_html = self.render("notification/email_body.html", {
             "message": messages["full.html"],
         }, context)
 
+        # The outputs may be shared, fill in the recipient URLs.
+        subject = context.fill_placeholders(subject)
+        body = context.fill_placeholders(body)
+        body_html = context.fill_placeholders(body_html)
+        messages['full.html'] = context.fill_placeholders(messages['full.html'])
+
         if not is_html:
             send_mail(subject, body, settings.DEFAULT_FROM_EMAIL,
                       [recipient.email])
@@ -1,11 +1,15 @@
 from __future__ import absolute_import, unicode_literals
+import logging
+from datetime import timedelta
+
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core import urlresolvers
-from django.core.exceptions import ImproperlyConfigured
+from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
+from django.db.models import F
 from django.db.models.loading import get_app
-from django.template import Context
 from django.template.loader import render_to_string
+from django.utils import timezone
 from django.utils.translation import ugettext
 
 from notification import backends
@@ -21,6 +25,8 @@ except NameError:
 
 DEFAULT_HTTP_PROTOCOL = getattr(settings, "DEFAULT_HTTP_PROTOCOL", "http")
 
+logger = logging.getLogger(__name__)
+
 
 class SiteBackend(backends.BaseBackend):
     """
@@ -29,6 +35,63 @@ class SiteBackend(backends.BaseBackend):
     spam_sensitivity = 1
         
     def deliver(self, recipient, sender, notice_type, extra_context):
+        notice = self.build_notice(recipient, sender, notice_type, extra_context)
+        if not self.coalesce([notice], notice_type):
+            notice.save()
+
+    def deliver_many(self, recipients, sender, notice_type, extra_context):
+        if type(self).deliver != SiteBackend.deliver:
+            # deliver() is customized, honour it.
+            return super(SiteBackend, self).deliver_many(recipients, sender, notice_type, extra_context)
+        from notification.models import Notice
+        results = []
+        notices = []
+        with backends.shared_rendering():
+            for recipient in recipients:
+                try:
+                    notices.append(self.build_notice(recipient, sender, notice_type, extra_context))
+                except ObjectDoesNotExist as e:
+                    logger.warning("Can't to deliver notice {0} to user {1} since {2}".format(
+                        notice_type.label, recipient, e))
+                    results.append((recipient, False))
+                else:
+                    results.append((recipient, True))
+        # unsaved notices compare equal, compare identities
+        merged = set(id(notice) for notice in self.coalesce(notices, notice_type))
+        Notice.objects.bulk_create([notice for notice in notices if id(notice) not in merged])
+        return results
+
+    def coalesce(self, notices, notice_type):
+        """
+        Merges the given unsaved notices into the notices with the same
+        coalesce key added within the coalesce window of notice_type, with
+        one query to find them. Returns the merged notices.
+        """
+        from notification.models import Notice
+        keys = set(notice.coalesce_key for notice in notices if notice.coalesce_key)
+        if not keys:
+            return []
+        since = timezone.now() - timedelta(seconds=notice_type.coalesce_window)
+        recent = dict(Notice.objects.filter(
+            coalesce_key__in=keys, added__gte=since
+        ).order_by("added").values_list("coalesce_key", "pk"))
+        merged = []
+        for notice in notices:
+            pk = recent.get(notice.coalesce_key)
+            if pk is None:
+                continue
+            Notice.objects.filter(pk=pk).update(
+                message=notice.message,
+                sender=notice.sender,
+                count=F("count") + 1,
+                unseen=True,
+                archived=False,
+            )
+            merged.append(notice)
+        return merged
+
+    def build_notice(self, recipient, sender, notice_type, extra_context):
+        """Returns an unsaved Notice for the recipient."""
         # TODO: require this to be passed in extra_context
         current_site = Site.objects.get_current()
         notices_url = "{0}://{1}{2}".format(
@@ -38,7 +101,7 @@ class SiteBackend(backends.BaseBackend):
         )
         
         # update context with user specific translations
-        context = Context({
+        context = backends.RecordingContext({
             "user": recipient,  # Old compatible
             "recipient": recipient,
             "sender": sender,
@@ -51,11 +114,12 @@ class SiteBackend(backends.BaseBackend):
         messages = self.get_formatted_messages((
             "notice.html",
         ), notice_type.label, context)
-        from notification.models import Notice
-        notice = Notice.objects.create(
+        from notification.models import Notice, get_coalesce_key
+        return Notice(
             recipient=recipient,
             sender=sender,
             notice_type=notice_type,
             message=messages['notice.html'],
             on_site=True,
+            coalesce_key=get_coalesce_key(recipient, notice_type, extra_context) or "",
         )
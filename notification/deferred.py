@@ -0,0 +1,168 @@
+from __future__ import absolute_import, unicode_literals
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+# a notice sent by send_observation_notices_for inside a deferred block is
+# recorded here, and sent once per (object, signal) when the block succeeds.
+_state = threading.local()
+
+
+def _stack():
+    try:
+        return _state.stack
+    except AttributeError:
+        _state.stack = []
+        return _state.stack
+
+
+def _transactions():
+    # databases whose transaction is managed by a defer_observation_notices
+    try:
+        return _state.transactions
+    except AttributeError:
+        _state.transactions = set()
+        return _state.transactions
+
+
+def begin():
+    """Starts a (possibly nested) block of deferred observation notices."""
+    _stack().append(OrderedDict())
+
+
+def commit():
+    """
+    Ends the current block. The outermost block sends the recorded notices,
+    an inner one passes them to its parent.
+    """
+    stack = _stack()
+    pending = stack.pop()
+    if stack:
+        for key, call in pending.items():
+            _merge(stack[-1], key, call)
+    else:
+        from notification.models import send_observation_notices_for
+        for call in pending.values():
+            send_observation_notices_for(**call)
+
+
+def rollback():
+    """Ends the current block, dropping the notices recorded in it."""
+    _stack().pop()
+
+
+def reset():
+    """Drops all blocks of the current thread."""
+    _state.stack = []
+    _state.transactions = set()
+
+
+def is_active():
+    return bool(_stack())
+
+
+def defer(observed, signal, extra_context, on_site, sender):
+    """
+    Records a call of send_observation_notices_for, if a deferred block
+    is active. Returns False otherwise.
+
+    Calls for the same object and signal are coalesced: the latest
+    instance, on_site and sender win, extra contexts are merged.
+    """
+    stack = _stack()
+    if not stack:
+        return False
+    content_type = ContentType.objects.get_for_model(observed)
+    key = (content_type.pk, observed.pk, signal)
+    _merge(stack[-1], key, {
+        "observed": observed,
+        "signal": signal,
+        "extra_context": dict(extra_context or {}),
+        "on_site": on_site,
+        "sender": sender,
+    })
+    return True
+
+
+def _merge(pending, key, call):
+    if key in pending:
+        extra_context = pending[key]["extra_context"]
+        extra_context.update(call["extra_context"])
+        call = dict(call, extra_context=extra_context)
+    pending[key] = call
+
+
+class defer_observation_notices(object):
+    """
+    Runs a block in a transaction and defers the observation notices sent
+    inside it until the transaction is committed. Notices for the same
+    object and signal are sent once. Nothing is sent if the block raises.
+    A nested block runs in the transaction of the outermost block using
+    the same database, in a savepoint: if it raises, its writes are rolled
+    back with its notices. Without savepoint support, its writes stay in
+    the transaction, and so its notices are passed to the outer block.
+
+    Can be used as a context manager or as a decorator::
+
+        with defer_observation_notices():
+            obj.title = title
+            obj.save()
+            obj.tags.add(tag)
+            obj.save()
+    """
+
+    def __init__(self, using=None):
+        self.using = using
+
+    def __enter__(self):
+        # An inner commit_on_success would commit the outer transaction,
+        # so only the outermost block of a database manages it.
+        using = self.using or DEFAULT_DB_ALIAS
+        transactions = _transactions()
+        self._savepoint = None
+        if using in transactions:
+            self._transaction = None
+            if connections[using].features.uses_savepoints:
+                self._savepoint = transaction.savepoint(using=using)
+        else:
+            self._transaction = transaction.commit_on_success(using=using)
+        begin()
+        if self._transaction is not None:
+            try:
+                self._transaction.__enter__()
+            except:
+                rollback()
+                raise
+            transactions.add(using)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        using = self.using or DEFAULT_DB_ALIAS
+        if self._transaction is not None:
+            _transactions().discard(using)
+            try:
+                self._transaction.__exit__(exc_type, exc_value, traceback)
+            except:
+                rollback()
+                raise
+        elif self._savepoint is not None:
+            if exc_type is None:
+                transaction.savepoint_commit(self._savepoint, using=using)
+            else:
+                transaction.savepoint_rollback(self._savepoint, using=using)
+        if exc_type is None:
+            commit()
+        elif self._transaction is None and self._savepoint is None:
+            # The writes of the block are committed by the outer one.
+            commit()
+        else:
+            rollback()
+
+    def __call__(self, func):
+        @wraps(func)
+        def inner(*args, **kwargs):
+            with defer_observation_notices(self.using):
+                return func(*args, **kwargs)
+        return inner
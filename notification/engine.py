@@ -8,27 +8,32 @@ from multiprocessing import Pool
 from multiprocessing.pool import ThreadPool
 # from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-try:
-    import cPickle as pickle
-except ImportError:
-    import pickle
-
 from django.conf import settings
 from django.core.mail import mail_admins
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
 from django.db import connections
+from django.utils import timezone
 
 from .lockfile import FileLock, AlreadyLocked, LockTimeout
 
-from notification.models import NoticeQueueBatch
 from notification import models as notification
+from notification.queues import get_queue_storage
 
 # lock timeout value. how long to wait for the lock to become available.
 # default behavior is to never wait for the lock to be available.
 LOCK_WAIT_TIMEOUT = getattr(settings, "NOTIFICATION_LOCK_WAIT_TIMEOUT", -1)
 NOTICEUID_MAX_SIZE = getattr(settings, "NOTIFICATION_NOTICEUID_MAX_SIZE", 100000)
+# number of batches sent from a lane (priority) per round, priority + 1 for
+# lanes missing here (1 for negative priorities)
+LANE_WEIGHTS = getattr(settings, "NOTIFICATION_QUEUE_LANE_WEIGHTS", {})
+# if more batches than this are queued, expired batches of lanes up to
+# SHED_PRIORITY are dropped. None disables shedding.
+SHED_BACKLOG = getattr(settings, "NOTIFICATION_QUEUE_SHED_BACKLOG", None)
+SHED_PRIORITY = getattr(settings, "NOTIFICATION_QUEUE_SHED_PRIORITY", 0)
+# recipients of a queued batch sent between two renewals of its lease
+PART_SIZE = getattr(settings, "NOTIFICATION_QUEUE_PART_SIZE", 200)
 
 logger = logging.getLogger(__name__)
 
@@ -65,26 +70,35 @@ def send_all(workers=1, processes=False):
     try:
         # nesting the try statement to be Python 2.4
         try:
-            for queued_batch in NoticeQueueBatch.objects.order_by("pk"):
-                notices = pickle.loads(str(queued_batch.pickled_data).decode("base64"))
-                for users, label, extra_context, on_site, sender in notices:
-
-                    if workers == 1:
-                        result = _send_batch_part(users, label, extra_context, on_site, sender)
-                        for k, v in result.items():
-                            sent.setdefault(k, 0)
-                            sent[k] += v
-                    else:
-                        results = pool.map(
-                            _send_batch_part_mp,
-                            ([part, label, extra_context, on_site, sender] for part in chunks(users, workers))
-                         )
-                        for result in results:
-                            for k, v in result.items():
-                                sent.setdefault(k, 0)
-                                sent[k] += v
-
-                queued_batch.delete()
+            storage = get_queue_storage()
+            for queued_batch in iter_queued_batches(storage):
+                try:
+                    for users, label, extra_context, on_site, sender in queued_batch.notices:
+                        for users_part in chunks(list(users), PART_SIZE):
+
+                            if workers == 1:
+                                result = _send_batch_part(users_part, label, extra_context, on_site, sender)
+                                for k, v in result.items():
+                                    sent.setdefault(k, 0)
+                                    sent[k] += v
+                            else:
+                                results = pool.map(
+                                    _send_batch_part_mp,
+                                    ([part, label, extra_context, on_site, sender] for part in chunks(users_part, workers))
+                                 )
+                                for result in results:
+                                    for k, v in result.items():
+                                        sent.setdefault(k, 0)
+                                        sent[k] += v
+
+                            # Keep other consumers off the batch.
+                            storage.renew(queued_batch)
+                except:
+                    # keep it for the next run
+                    storage.retry(queued_batch)
+                    raise
+
+                storage.ack(queued_batch)
                 batches += 1
 
             uid_qs = notification.NoticeUid.objects.all()
@@ -117,34 +131,110 @@ def send_all(workers=1, processes=False):
     logger.debug("done at %s", datetime.now())
 
 
+def get_lane_weight(priority):
+    """Returns the number of batches sent from a lane per round."""
+    try:
+        return LANE_WEIGHTS[priority]
+    except KeyError:
+        return max(priority, 0) + 1
+
+
+def shed_expired_batches(storage=None):
+    """
+    Drops the expired batches of lanes up to SHED_PRIORITY, if more than
+    SHED_BACKLOG batches are queued. Returns the number of dropped batches.
+    """
+    storage = storage or get_queue_storage()
+    if SHED_BACKLOG is None or storage.depth() <= SHED_BACKLOG:
+        return 0
+    shed = storage.shed(SHED_PRIORITY)
+    if shed:
+        logger.warning("backlog over {0} batches, dropped {1} expired batches".format(SHED_BACKLOG, shed))
+    return shed
+
+
+def iter_queued_batches(storage=None):
+    """
+    Claims and yields the due queued batches until none is left, the caller
+    acking each sent batch. Each round yields up to get_lane_weight()
+    batches of every lane, higher priorities first, so that bulk lanes still
+    progress and batches queued meanwhile in higher lanes are sent in the
+    next round.
+    """
+    storage = storage or get_queue_storage()
+    while True:
+        shed_expired_batches(storage)
+        now = timezone.now()
+        lanes = storage.lanes(now)
+        if not lanes:
+            return
+        for priority in lanes:
+            # Claimed one by one, so that a failure leaves the
+            # other batches due.
+            for i in range(get_lane_weight(priority)):
+                claimed = storage.claim(priority, 1, now)
+                if not claimed:
+                    break
+                yield claimed[0]
+
+
+def next_due_time():
+    """Returns the time the next queued batch is due, None if the queue is empty."""
+    return get_queue_storage().next_due()
+
+
+def run_daemon(workers=1, processes=False, max_sleep=60):
+    """
+    Sends the due batches, then sleeps until the next batch is due, at most
+    max_sleep seconds (to notice the batches queued meanwhile), forever.
+    """
+    while True:
+        send_all(workers, processes)
+        due = next_due_time()
+        if due is None:
+            delay = max_sleep
+        else:
+            # at least a second, if due batches are left (e.g. the lock
+            # is held by another process)
+            delay = min(max(total_seconds(due - timezone.now()), 1), max_sleep)
+        logger.debug("sleeping {0:.1f} seconds".format(delay))
+        time.sleep(delay)
+
+
+def total_seconds(delta):
+    """timedelta.total_seconds() for Python 2.6."""
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
+
+
 def _send_batch_part(users, label, extra_context, on_site, sender):
     """Sends part of queued batch"""
-    sent = {}
+    # The instance of QuerySet also can be pickled,
+    # so, ckecks the instance of user.
+    user_ids = [user for user in users if not isinstance(user, User)]
+    loaded = User.objects.in_bulk(user_ids) if user_ids else {}
+    recipients = []
     for user in users:
-        # The instance of QuerySet also can be pickled,
-        # so, ckecks the instance of user.
         if not isinstance(user, User):
-            try:
-                logger.info("loading user {0}".format(user))
-                user = User.objects.get(pk=user)
-            except User.DoesNotExist:
+            if user not in loaded:
                 # Ignore deleted users, just warn about them
                 logger.warning("not emitting notice {0} to user {1} since it does not exist".format(label, user))
                 continue
-
-        logger.info("emitting notice {0} to {1}".format(label, user))
-        # call this once per user to be atomic and allow for logger to
-        # accurately show how long each takes.
-        try:
-            result = notification.send_now([user], label, extra_context, on_site, sender)
-        except ObjectDoesNotExist as e:
-            logger.warning("Can't to emit notice {0} to user {1} since {2}".format(label, user, e))
-        else:
-            for k, v in result.items():
-                sent.setdefault(k, 0)
-                sent[k] += v
-
-    return sent
+            user = loaded[user]
+        recipients.append(user)
+    if not recipients:
+        return {}
+
+    # One send_now() for the whole part, so that backends, signals,
+    # languages and rendering work on all its recipients at once. send_now()
+    # skips the recipients it fails to deliver, an error left is about the
+    # whole part: nothing is sent again, the notices already delivered can't
+    # be taken back.
+    logger.info("emitting notice {0} to {1} users".format(label, len(recipients)))
+    try:
+        return notification.send_now(recipients, label, extra_context, on_site, sender)
+    except ObjectDoesNotExist as e:
+        logger.warning("Can't to emit notice {0} to {1} users since {2}".format(label, len(recipients), e))
+        return {}
 
 
 def _send_batch_part_mp(args):
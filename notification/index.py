@@ -0,0 +1,224 @@
+from __future__ import absolute_import, unicode_literals
+import hashlib
+import random
+import struct
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.contenttypes.models import ContentType
+
+# an in-process index of observed (content type, signal) pairs, used to skip
+# the observation queries for objects nobody observes. Disabled by default.
+ENABLED = getattr(settings, "NOTIFICATION_OBSERVATION_INDEX", False)
+# index observed object ids too, not only (content type, signal) pairs
+INDEX_IDS = getattr(settings, "NOTIFICATION_OBSERVATION_INDEX_IDS", False)
+# if set, object ids are kept in a Bloom filter of this number of bits
+# instead of a set, to bound memory for large tables
+BLOOM_SIZE = getattr(settings, "NOTIFICATION_OBSERVATION_INDEX_BLOOM_SIZE", None)
+# seconds after which the index is reloaded from the database
+TIMEOUT = getattr(settings, "NOTIFICATION_OBSERVATION_INDEX_TIMEOUT", 300)
+
+# the index is reloaded by all processes, sharing the cache,
+# when the value of this key changes
+VERSION_CACHE_KEY = "notification.observation_index.version"
+# prefix of the keys marking the objects observed since the index was loaded
+MARKER_CACHE_PREFIX = "notification.observation_index.observed."
+
+
+class BloomFilter(object):
+    """
+    A Bloom filter of strings with a fixed size in bits.
+
+    Can return false positives, but never false negatives.
+    """
+    hashes = 4
+
+    def __init__(self, size):
+        self.size = size
+        self.bits = bytearray((size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.md5(key.encode("utf-8")).digest()
+        for value in struct.unpack(b"<4I", digest)[:self.hashes]:
+            yield value % self.size
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, key):
+        for position in self._positions(key):
+            if not self.bits[position // 8] & (1 << (position % 8)):
+                return False
+        return True
+
+
+class ObservationIndex(object):
+    """
+    Keeps in memory which (content type, signal) pairs, and optionally
+    which objects, have observers.
+
+    The index can have false positives (an observer was removed after
+    the index was loaded), but no false negatives: a new (content type,
+    signal) pair increments the version in the cache, and the version is
+    read again before answering that an object is not observed. With
+    object ids, a new observation of a known pair sets a marker key in the
+    cache instead, kept until all processes have reloaded the index (twice
+    the timeout).
+
+    The index is (re)loaded in a background thread, so that saving an
+    object never waits for the table to be read; until it is loaded, all
+    objects are reported as observed.
+    """
+
+    def __init__(self, enabled=ENABLED, index_ids=INDEX_IDS,
+                 bloom_size=BLOOM_SIZE, timeout=TIMEOUT):
+        self.enabled = enabled
+        self.index_ids = index_ids
+        self.bloom_size = bloom_size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pairs = None
+        self._ids = None
+        self._version = None
+        self._loaded_at = 0
+        self._loading = False
+
+    def _make_key(self, content_type_id, object_id, signal):
+        return "{0}:{1}:{2}".format(content_type_id, signal, object_id)
+
+    def _marker_key(self, key):
+        return MARKER_CACHE_PREFIX + hashlib.md5(key.encode("utf-8")).hexdigest()
+
+    def _bump_version(self):
+        """Changes the version in the cache, without losing concurrent changes."""
+        try:
+            cache.incr(VERSION_CACHE_KEY)
+        except ValueError:
+            # Not set yet, or evicted: a random start differs from the
+            # versions loaded before.
+            if not cache.add(VERSION_CACHE_KEY, random.randint(1, 2 ** 62)):
+                cache.incr(VERSION_CACHE_KEY)
+
+    def load(self):
+        """Loads the index from the database."""
+        from notification.models import ObservedItem
+        # Read the version first, so that observations added
+        # during the load cause a reload.
+        version = cache.get(VERSION_CACHE_KEY)
+        started_at = time.time()
+        pairs = set(ObservedItem.objects.values_list(
+            "content_type", "signal"
+        ).order_by().distinct())
+        ids = None
+        if self.index_ids:
+            ids = BloomFilter(self.bloom_size) if self.bloom_size else set()
+            rows = ObservedItem.objects.values_list(
+                "content_type", "object_id", "signal"
+            ).order_by().iterator()
+            for content_type_id, object_id, signal in rows:
+                ids.add(self._make_key(content_type_id, object_id, signal))
+        with self._lock:
+            self._pairs, self._ids = pairs, ids
+            self._version = version
+            self._loaded_at = started_at
+
+    def reload(self):
+        """Loads the index in a background thread, unless it is loading."""
+        with self._lock:
+            if self._loading:
+                return
+            self._loading = True
+        thread = threading.Thread(target=self._load_in_background)
+        thread.daemon = True
+        thread.start()
+
+    def _load_in_background(self):
+        from django.db import connection
+        try:
+            self.load()
+        finally:
+            with self._lock:
+                self._loading = False
+            # The thread has its own connection.
+            connection.close()
+
+    def invalidate(self):
+        """Makes all processes reload the index."""
+        self._bump_version()
+        with self._lock:
+            self._pairs = None
+
+    def is_observed(self, observed, signal):
+        """
+        Returns False if the object has surely no observers for the signal.
+        """
+        if not self.enabled:
+            return True
+        with self._lock:
+            pairs, ids, version, loaded_at = self._pairs, self._ids, self._version, self._loaded_at
+        if pairs is None or (self.timeout and time.time() - loaded_at > self.timeout):
+            # Let the database answer until the index is reloaded.
+            self.reload()
+            return True
+        content_type = ContentType.objects.get_for_model(observed)
+        keys = [VERSION_CACHE_KEY]
+        if (content_type.pk, signal) in pairs:
+            if ids is None:
+                return True
+            key = self._make_key(content_type.pk, observed.pk, signal)
+            if key in ids:
+                return True
+            if self.timeout:
+                keys.append(self._marker_key(key))
+        # A negative answer needs the current version, other processes may
+        # have added pairs since the load.
+        values = cache.get_many(keys)
+        if len(values) > 1:
+            return True
+        if values.get(VERSION_CACHE_KEY) != version:
+            self.reload()
+            return True
+        return False
+
+    def add(self, content_type_id, object_id, signal):
+        """Registers a new observation."""
+        self.add_many([(content_type_id, object_id, signal)])
+
+    def add_many(self, observations):
+        """
+        Registers new observations, given as
+        (content_type_id, object_id, signal) tuples.
+        """
+        if not self.enabled:
+            return
+        observations = list(observations)
+        with self._lock:
+            # Pairs of a previous load existed then, even if it is stale.
+            # Without a load, nothing is known.
+            new_pairs = self._pairs is None or any(
+                (content_type_id, signal) not in self._pairs
+                for content_type_id, object_id, signal in observations
+            )
+            if self._pairs is not None:
+                for content_type_id, object_id, signal in observations:
+                    self._pairs.add((content_type_id, signal))
+                    if self._ids is not None:
+                        self._ids.add(self._make_key(content_type_id, object_id, signal))
+        use_markers = self.index_ids and self.timeout
+        if use_markers:
+            # Other processes find the objects here until they reload.
+            cache.set_many(dict(
+                (self._marker_key(self._make_key(*observation)), 1)
+                for observation in observations
+            ), 2 * self.timeout)
+        if not new_pairs and (use_markers or not self.index_ids):
+            # Nothing other processes need to reload.
+            return
+        # This process reloads too: the version it loaded may be older than
+        # the one incremented here.
+        self._bump_version()
+
+observation_index = ObservationIndex()
@@ -0,0 +1,117 @@
+import logging
+import random
+import time
+from optparse import make_option
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from notification import managers
+from notification.models import NoticeType, ObservedItem
+
+SIGNAL = "benchmark"
+# rows inserted per query
+BULK_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = ("Measure ObservedItem.objects.all_for() and get_for() looking up the string "
+            "object_id column and the integer object_int_id column. Each round fills the "
+            "table once per column, in a transaction which is rolled back, and the order "
+            "of the columns alternates between rounds.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('-r', '--rows', dest='rows', type='int',
+                    help='Number of observed items', default=1000000),
+        make_option('-u', '--observers', dest='observers', type='int',
+                    help='Number of observers of each object', default=10),
+        make_option('-l', '--lookups', dest='lookups', type='int',
+                    help='Number of lookups of each kind per round', default=1000),
+        make_option('-n', '--rounds', dest='rounds', type='int',
+                    help='Number of rounds', default=2),
+    )
+
+    def handle(self, *args, **options):
+        logging.basicConfig(level=logging.DEBUG, format="%(message)s")
+        logging.info("-" * 72)
+        observers, rounds = options['observers'], options['rounds']
+        if observers < 1 or options['rows'] < observers or rounds < 1:
+            raise CommandError("--observers and --rounds must be at least 1, "
+                               "--rows at least --observers")
+        objects = options['rows'] // observers
+        totals = {False: [0, 0], True: [0, 0]}
+        for i in range(rounds):
+            # the second column runs on a warmer database, alternate them
+            for int_ids in ((False, True) if i % 2 == 0 else (True, False)):
+                # nothing is committed, so that the benchmark rows never show up
+                with transaction.commit_manually():
+                    try:
+                        observing = self.fill(objects, observers)
+                        all_for, get_for = self.run(objects, observing, options['lookups'], int_ids)
+                    finally:
+                        transaction.rollback()
+                totals[int_ids][0] += all_for
+                totals[int_ids][1] += get_for
+                self.report("round {0}, {1}".format(i + 1, self.column(int_ids)),
+                            all_for, get_for, options['lookups'])
+        for int_ids in (False, True):
+            all_for, get_for = totals[int_ids]
+            self.report("{0} rounds, {1}".format(rounds, self.column(int_ids)),
+                        all_for, get_for, options['lookups'] * rounds)
+
+    def fill(self, objects, observers):
+        """
+        Creates observers users, each observing the user ids 1 to objects,
+        inserted in a random order. The observed users need not exist.
+        """
+        User.objects.bulk_create([
+            User(username="benchmark-observer-{0}".format(i)) for i in range(observers)
+        ])
+        observing = list(User.objects.filter(username__startswith="benchmark-observer-"))
+        notice_type = NoticeType.objects.create(
+            label="benchmark-observed", display="benchmark", description="benchmark", default=0
+        )
+        content_type = ContentType.objects.get_for_model(User)
+        object_ids = list(range(1, objects + 1))
+        random.shuffle(object_ids)
+        rows = []
+        start = time.time()
+        for object_id in object_ids:
+            for observer in observing:
+                # bulk_create() does not call save(), which fills object_int_id
+                rows.append(ObservedItem(user=observer, content_type=content_type,
+                                         object_id=str(object_id), object_int_id=object_id,
+                                         notice_type=notice_type, signal=SIGNAL))
+            if len(rows) >= BULK_SIZE:
+                ObservedItem.objects.bulk_create(rows)
+                rows = []
+        ObservedItem.objects.bulk_create(rows)
+        logging.info("{0} observed items created in {1:.1f} s".format(
+            objects * observers, time.time() - start))
+        return observing
+
+    def run(self, objects, observing, lookups, int_ids):
+        """Returns the seconds spent in all_for() and in get_for()."""
+        previous = managers.INT_OBJECT_IDS
+        managers.INT_OBJECT_IDS = int_ids
+        try:
+            observed = [User(pk=random.randint(1, objects)) for i in range(lookups)]
+            start = time.time()
+            for obj in observed:
+                list(ObservedItem.objects.all_for(obj, SIGNAL))
+            all_for = time.time() - start
+            start = time.time()
+            for obj in observed:
+                ObservedItem.objects.get_for(obj, random.choice(observing), SIGNAL)
+            get_for = time.time() - start
+        finally:
+            managers.INT_OBJECT_IDS = previous
+        return all_for, get_for
+
+    def column(self, int_ids):
+        return "object_int_id" if int_ids else "object_id"
+
+    def report(self, name, all_for, get_for, lookups):
+        logging.info("{0}: all_for {1:.3f} ms, get_for {2:.3f} ms".format(
+            name, 1000 * all_for / max(lookups, 1), 1000 * get_for / max(lookups, 1)))
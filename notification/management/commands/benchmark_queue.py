@@ -0,0 +1,68 @@
+import logging
+import os
+import shutil
+import tempfile
+import time
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from notification.queues import DatabaseQueueStorage, MemoryQueueStorage, SQLiteQueueStorage
+
+
+class Command(BaseCommand):
+    help = ("Measure the enqueue and claim/ack throughput of the notice queue storages. "
+            "The database storage runs in a transaction which is rolled back.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('-n', '--batches', dest='batches', type='int',
+                    help='Number of batches queued and sent', default=10000),
+        make_option('-u', '--users', dest='users', type='int',
+                    help='Number of users per batch', default=100),
+        make_option('-s', '--storages', dest='storages', default='memory,sqlite,database',
+                    help='Comma separated storages among memory, sqlite and database'),
+    )
+
+    def handle(self, *args, **options):
+        logging.basicConfig(level=logging.DEBUG, format="%(message)s")
+        logging.info("-" * 72)
+        batches = options['batches']
+        notices = [(list(range(options['users'])), "benchmark", {}, True, None)]
+        for name in options['storages'].split(","):
+            name = name.strip()
+            if name == "memory":
+                self.run(name, MemoryQueueStorage(), batches, notices)
+            elif name == "sqlite":
+                directory = tempfile.mkdtemp()
+                try:
+                    storage = SQLiteQueueStorage(os.path.join(directory, "queue.sqlite3"))
+                    self.run(name, storage, batches, notices)
+                finally:
+                    shutil.rmtree(directory)
+            elif name == "database":
+                # nothing is committed, so that running workers never see
+                # the benchmark batches
+                with transaction.commit_manually():
+                    try:
+                        self.run(name, DatabaseQueueStorage(), batches, notices)
+                    finally:
+                        transaction.rollback()
+            else:
+                raise CommandError("Unknown storage {0!r}".format(name))
+
+    def run(self, name, storage, batches, notices):
+        start = time.time()
+        for i in range(batches):
+            storage.enqueue([notices], priority=-1000)
+        enqueued = time.time()
+        sent = 0
+        while True:
+            claimed = storage.claim(-1000, 100)
+            if not claimed:
+                break
+            for batch in claimed:
+                storage.ack(batch)
+                sent += 1
+        done = time.time()
+        logging.info("{0}: enqueue {1:.0f} batches/s, claim and ack {2:.0f} batches/s ({3} batches)".format(
+            name, batches / max(enqueued - start, 1e-6), sent / max(done - enqueued, 1e-6), sent))
@@ -0,0 +1,51 @@
+import logging
+import os
+import subprocess
+import sys
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+
+# run in a fresh interpreter, so that nothing is imported yet
+SCRIPT = """
+import time
+start = time.time()
+from notification import models
+imported = time.time()
+list(models.NOTIFICATION_BACKENDS.items())
+loaded = time.time()
+print("{0} {1}".format(imported - start, loaded - imported))
+"""
+
+
+class Command(BaseCommand):
+    help = ("Measure the time to import notification.models, and the time to load "
+            "the backends, which was spent at import time before they were loaded lazily.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('-r', '--runs', dest='runs', type='int',
+                    help='Number of interpreters started', default=10),
+    )
+
+    def handle(self, *args, **options):
+        logging.basicConfig(level=logging.DEBUG, format="%(message)s")
+        logging.info("-" * 72)
+        runs = options['runs']
+        if runs < 1:
+            raise CommandError("--runs must be at least 1")
+        # manage.py has set DJANGO_SETTINGS_MODULE
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(sys.path)
+        imports, loads = [], []
+        for run in range(runs):
+            process = subprocess.Popen([sys.executable, "-c", SCRIPT], env=env,
+                                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            out, err = process.communicate()
+            if process.returncode:
+                raise CommandError(err.decode("utf-8", "replace"))
+            imported, loaded = out.decode("ascii").split()
+            imports.append(float(imported))
+            loads.append(float(loaded))
+        logging.info("import notification.models: {0:.1f} ms (min {1:.1f} ms)".format(
+            1000 * sum(imports) / runs, 1000 * min(imports)))
+        logging.info("load backends on first use: {0:.1f} ms (min {1:.1f} ms)".format(
+            1000 * sum(loads) / runs, 1000 * min(loads)))
@@ -0,0 +1,19 @@
+import logging
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from notification.backends.digest import send_digests
+
+
+class Command(BaseCommand):
+    help = "Send the due digests of buffered notices."
+
+    option_list = BaseCommand.option_list + (
+        make_option('-b', '--batch-size', dest='batch_size', type='int',
+                    help='Number of digests sent per batch', default=100),
+    )
+
+    def handle(self, *args, **options):
+        logging.basicConfig(level=logging.DEBUG, format="%(message)s")
+        logging.info("-" * 72)
+        sent = send_digests(batch_size=options['batch_size'])
+        logging.info("{0} digests sent".format(sent))
@@ -1,7 +1,7 @@
 import logging
 from optparse import make_option
 from django.core.management.base import BaseCommand
-from notification.engine import send_all
+from notification.engine import send_all, run_daemon
 
 
 class Command(BaseCommand):
@@ -12,9 +12,17 @@ class Command(BaseCommand):
                     help='Number of workers used to emit notices', default=1),
         make_option('-p', '--processes', dest='processes', action='store_true',
                     help='Use process pool instead of thread pool', default=False),
+        make_option('-d', '--daemon', dest='daemon', action='store_true',
+                    help='Keep running, sleeping until the next queued notice is due', default=False),
+        make_option('-s', '--max-sleep', dest='max_sleep', type='int',
+                    help='Max number of seconds slept in daemon mode', default=60),
     )
 
     def handle(self, *args, **options):
         logging.basicConfig(level=logging.DEBUG, format="%(message)s")
         logging.info("-" * 72)
-        send_all(workers=options['workers'], processes=options['processes'])
+        if options['daemon']:
+            run_daemon(workers=options['workers'], processes=options['processes'],
+                       max_sleep=options['max_sleep'])
+        else:
+            send_all(workers=options['workers'], processes=options['processes'])
@@ -0,0 +1,19 @@
+import logging
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from notification.models import ObservedItem
+
+
+class Command(BaseCommand):
+    help = "Fill the integer object id of existing observed items."
+
+    option_list = BaseCommand.option_list + (
+        make_option('-b', '--batch-size', dest='batch_size', type='int',
+                    help='Number of observed items read per query', default=1000),
+    )
+
+    def handle(self, *args, **options):
+        logging.basicConfig(level=logging.DEBUG, format="%(message)s")
+        logging.info("-" * 72)
+        updated = ObservedItem.objects.fill_int_object_ids(batch_size=options['batch_size'])
+        logging.info("{0} observed items updated".format(updated))
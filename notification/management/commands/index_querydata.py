@@ -0,0 +1,29 @@
+import logging
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from notification.matching import index_query_data
+from notification.models import QueryData
+
+
+class Command(BaseCommand):
+    help = "Rebuild the terms of saved query data, used to match objects."
+
+    option_list = BaseCommand.option_list + (
+        make_option('-b', '--batch-size', dest='batch_size', type='int',
+                    help='Number of query data indexed at once', default=1000),
+    )
+
+    def handle(self, *args, **options):
+        logging.basicConfig(level=logging.DEBUG, format="%(message)s")
+        logging.info("-" * 72)
+        batch_size = options['batch_size']
+        indexed = 0
+        last_pk = 0
+        while True:
+            query_datas = list(QueryData.objects.filter(pk__gt=last_pk).order_by("pk")[:batch_size])
+            if not query_datas:
+                break
+            last_pk = query_datas[-1].pk
+            index_query_data(query_datas)
+            indexed += len(query_datas)
+        logging.info("{0} query data indexed".format(indexed))
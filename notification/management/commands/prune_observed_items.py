@@ -0,0 +1,19 @@
+import logging
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from notification.models import ObservedItem
+
+
+class Command(BaseCommand):
+    help = "Delete observed items whose observed objects do not exist anymore."
+
+    option_list = BaseCommand.option_list + (
+        make_option('-b', '--batch-size', dest='batch_size', type='int',
+                    help='Number of observed items checked per query', default=1000),
+    )
+
+    def handle(self, *args, **options):
+        logging.basicConfig(level=logging.DEBUG, format="%(message)s")
+        logging.info("-" * 72)
+        deleted = ObservedItem.objects.delete_orphans(batch_size=options['batch_size'])
+        logging.info("{0} observed items deleted".format(deleted))
@@ -0,0 +1,13 @@
+import logging
+from django.core.management.base import BaseCommand
+from notification.models import ObserverCount
+
+
+class Command(BaseCommand):
+    help = "Recompute the observer counts from observed items."
+
+    def handle(self, *args, **options):
+        logging.basicConfig(level=logging.DEBUG, format="%(message)s")
+        logging.info("-" * 72)
+        changed = ObserverCount.objects.reconcile()
+        logging.info("{0} observer counts changed".format(changed))
@@ -0,0 +1,14 @@
+import logging
+from django.core.management.base import BaseCommand
+from notification.models import QueryData
+
+
+class Command(BaseCommand):
+    help = ("Recompute the hashes of saved query data and merge duplicates. "
+            "Run it immediately after upgrading from the hash() based hashes.")
+
+    def handle(self, *args, **options):
+        logging.basicConfig(level=logging.DEBUG, format="%(message)s")
+        logging.info("-" * 72)
+        updated, deleted = QueryData.objects.rehash()
+        logging.info("{0} query data updated, {1} duplicates deleted".format(updated, deleted))
@@ -1,6 +1,12 @@
 from __future__ import absolute_import, unicode_literals
 import copy
-from django.db import models
+import hashlib
+import json
+import struct
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import models, transaction, IntegrityError
+from django.db.models import Count, F
 from django.contrib.contenttypes.models import ContentType
 
 try:
@@ -11,6 +17,34 @@ except NameError:
     string_types = (str,)
     integer_types = (int,)
 
+# look up ObservedItems by the integer column object_int_id instead of
+# the object_id string, when the object ids are integers.
+# Enable it once object_int_id is filled for existing rows.
+INT_OBJECT_IDS = getattr(settings, "NOTIFICATION_INT_OBJECT_IDS", False)
+
+BIGINT_MAX = 2 ** 63 - 1
+
+
+def to_int_object_id(object_id):
+    """
+    Returns object_id as an integer if it is an integer or its canonical
+    string form which fits in a bigint column, otherwise None.
+    """
+    if isinstance(object_id, bool):
+        return None
+    if isinstance(object_id, integer_types):
+        value = object_id
+    else:
+        try:
+            value = int(object_id)
+        except (TypeError, ValueError):
+            return None
+        if str(value) != object_id:
+            return None
+    if -BIGINT_MAX <= value <= BIGINT_MAX:
+        return value
+    return None
+
 
 class NoticeManager(models.Manager):
 
@@ -68,14 +102,242 @@ class ObservedItemManager(models.Manager):
         to be sent when a signal is emited.
         """
         content_type = ContentType.objects.get_for_model(observed)
-        observed_items = self.filter(content_type=content_type, object_id=observed.id, signal=signal)
+        observed_items = self.filter_for(content_type, [observed.pk], signal=signal)
         return observed_items
 
     def get_for(self, observed, observer, signal):
         content_type = ContentType.objects.get_for_model(observed)
-        observed_item = self.get(content_type=content_type, object_id=observed.id, user=observer, signal=signal)
+        observed_item = self.filter_for(content_type, [observed.pk], user=observer, signal=signal).get()
         return observed_item
 
+    def filter_for(self, content_type, object_ids, **kwargs):
+        """
+        Returns ObservedItems for the given content type and object ids.
+
+        Ids are coerced to the type of the column, so that the
+        (content_type, object_id, signal, user) index is used.
+        """
+        kwargs["content_type"] = content_type
+        int_ids = None
+        if INT_OBJECT_IDS:
+            int_ids = [to_int_object_id(object_id) for object_id in object_ids]
+            if None in int_ids:
+                int_ids = None
+        if int_ids is not None:
+            if len(int_ids) == 1:
+                kwargs["object_int_id"] = int_ids[0]
+            else:
+                kwargs["object_int_id__in"] = int_ids
+        else:
+            object_ids = [str(object_id) for object_id in object_ids]
+            if len(object_ids) == 1:
+                kwargs["object_id"] = object_ids[0]
+            else:
+                kwargs["object_id__in"] = object_ids
+        return self.filter(**kwargs)
+
+    def fetch_observed_objects(self, observed_items):
+        """
+        Resolves ``observed_object`` for all given ObservedItems with one
+        query per content type, instead of one query per item.
+
+        Items whose object does not exist anymore get ``None``.
+        """
+        observed_items = list(observed_items)
+        cache_attr = self.model.observed_object.cache_attr
+        by_content_type = {}
+        for item in observed_items:
+            by_content_type.setdefault(item.content_type_id, []).append(item)
+        for content_type_id, items in by_content_type.items():
+            content_type = ContentType.objects.get_for_id(content_type_id)
+            objects = self._objects_for(content_type, [i.object_id for i in items])
+            for item in items:
+                setattr(item, cache_attr, objects.get(item.object_id))
+        return observed_items
+
+    def delete_orphans(self, batch_size=1000):
+        """
+        Deletes ObservedItems whose observed object does not exist anymore.
+
+        Walks the table in primary key order, ``batch_size`` rows at a time,
+        so it can be run periodically on large tables.
+        Returns the number of deleted items.
+        """
+        deleted = 0
+        content_type_ids = self.values_list("content_type", flat=True).order_by().distinct()
+        for content_type_id in list(content_type_ids):
+            content_type = ContentType.objects.get_for_id(content_type_id)
+            last_pk = 0
+            while True:
+                rows = list(self.filter(
+                    content_type=content_type, pk__gt=last_pk
+                ).order_by("pk").values_list("pk", "object_id")[:batch_size])
+                if not rows:
+                    break
+                last_pk = rows[-1][0]
+                objects = self._objects_for(content_type, [r[1] for r in rows])
+                orphans = [pk for pk, object_id in rows if object_id not in objects]
+                if orphans:
+                    from notification.models import ObserverCount
+                    ObserverCount.objects.add_for(self.filter(pk__in=orphans), -1)
+                    self.filter(pk__in=orphans).delete()
+                    deleted += len(orphans)
+        return deleted
+
+    def fill_int_object_ids(self, batch_size=1000):
+        """
+        Fills object_int_id of existing ObservedItems, in batches of
+        batch_size rows. Returns the number of updated items.
+        """
+        updated = 0
+        last_pk = 0
+        while True:
+            rows = list(self.filter(
+                pk__gt=last_pk, object_int_id__isnull=True
+            ).order_by("pk").values_list("pk", "object_id")[:batch_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            by_int_id = {}
+            for pk, object_id in rows:
+                int_id = to_int_object_id(object_id)
+                if int_id is not None:
+                    by_int_id.setdefault(int_id, []).append(pk)
+            for int_id, pks in by_int_id.items():
+                updated += self.filter(pk__in=pks).update(object_int_id=int_id)
+        return updated
+
+    def _objects_for(self, content_type, object_ids):
+        """
+        Returns a dict of existing objects of given content type,
+        keyed by ``object_id`` as it is stored in ObservedItem.
+        """
+        model = content_type.model_class()
+        if model is None:
+            # The model was removed, nothing can be resolved.
+            return {}
+        pk_field = model._meta.pk
+        pks = {}
+        for object_id in set(object_ids):
+            try:
+                pks[pk_field.to_python(object_id)] = object_id
+            except ValidationError:
+                continue
+        objects = model._base_manager.in_bulk(list(pks.keys()))
+        return dict((pks[pk], obj) for pk, obj in objects.items() if pk in pks)
+
+
+class ObserverCountManager(models.Manager):
+
+    def counts_for(self, observed_objects, signal="post_save"):
+        """
+        Returns a dict of observer counts for the given objects,
+        with one query per content type.
+        """
+        by_content_type = {}
+        for obj in observed_objects:
+            content_type = ContentType.objects.get_for_model(obj)
+            by_content_type.setdefault(content_type, []).append(obj)
+        counts = {}
+        for content_type, objects in by_content_type.items():
+            rows = dict(self.filter(
+                content_type=content_type, signal=signal,
+                object_id__in=[str(obj.pk) for obj in objects]
+            ).values_list("object_id", "count"))
+            for obj in objects:
+                counts[obj] = rows.get(str(obj.pk), 0)
+        return counts
+
+    def count_for(self, observed, signal="post_save"):
+        """Returns the observer count of one object."""
+        return self.counts_for([observed], signal)[observed]
+
+    def add(self, content_type_id, object_id, signal, delta):
+        """Changes the observer count of an object by delta."""
+        lookup = {
+            "content_type": content_type_id,
+            "object_id": str(object_id),
+            "signal": signal,
+        }
+        if self.filter(**lookup).update(count=F("count") + delta) or delta <= 0:
+            return
+        sid = transaction.savepoint()
+        try:
+            self.create(content_type_id=content_type_id, object_id=str(object_id),
+                        signal=signal, count=delta)
+            transaction.savepoint_commit(sid)
+        except IntegrityError:
+            # Created by a concurrent call.
+            transaction.savepoint_rollback(sid)
+            self.filter(**lookup).update(count=F("count") + delta)
+
+    def add_for(self, observed_items, sign=1):
+        """
+        Adds (or, with sign=-1, subtracts) the given ObservedItems,
+        a list or a QuerySet, to the observer counts.
+        """
+        if isinstance(observed_items, models.query.QuerySet):
+            rows = observed_items.values_list(
+                "content_type", "object_id", "signal"
+            ).annotate(n=Count("pk")).order_by()
+        else:
+            deltas = {}
+            for item in observed_items:
+                key = (item.content_type_id, item.object_id, item.signal)
+                deltas[key] = deltas.get(key, 0) + 1
+            rows = [key + (n, ) for key, n in deltas.items()]
+        for content_type_id, object_id, signal, n in rows:
+            self.add(content_type_id, object_id, signal, sign * n)
+
+    def recount(self, content_type, object_ids):
+        """Recomputes the observer counts of the given objects."""
+        from notification.models import ObservedItem
+        object_ids = [str(object_id) for object_id in object_ids]
+        self.filter(content_type=content_type, object_id__in=object_ids).delete()
+        rows = ObservedItem.objects.filter(
+            content_type=content_type, object_id__in=object_ids
+        ).values_list("object_id", "signal").annotate(n=Count("pk")).order_by()
+        self.bulk_create([
+            self.model(content_type=content_type, object_id=object_id,
+                       signal=signal, count=n)
+            for object_id, signal, n in rows
+        ])
+
+    def reconcile(self):
+        """
+        Recomputes all observer counts from ObservedItems, one content type
+        at a time. Returns the number of changed counts.
+        """
+        from notification.models import ObservedItem
+        changed = 0
+        content_type_ids = set(ObservedItem.objects.values_list(
+            "content_type", flat=True).order_by().distinct())
+        content_type_ids.update(self.values_list(
+            "content_type", flat=True).order_by().distinct())
+        for content_type_id in content_type_ids:
+            actual = {}
+            rows = ObservedItem.objects.filter(
+                content_type=content_type_id
+            ).values_list("object_id", "signal").annotate(n=Count("pk")).order_by()
+            for object_id, signal, n in rows:
+                actual[(object_id, signal)] = n
+            stored = self.filter(content_type=content_type_id)
+            for pk, object_id, signal, count in stored.values_list("pk", "object_id", "signal", "count"):
+                n = actual.pop((object_id, signal), 0)
+                if n == 0:
+                    self.filter(pk=pk).delete()
+                    changed += 1
+                elif n != count:
+                    self.filter(pk=pk).update(count=n)
+                    changed += 1
+            self.bulk_create([
+                self.model(content_type_id=content_type_id, object_id=object_id,
+                           signal=signal, count=n)
+                for (object_id, signal), n in actual.items()
+            ])
+            changed += len(actual)
+        return changed
+
 
 class QueryDataManager(models.Manager):
     """QueryData Manager"""
@@ -84,42 +346,135 @@ class QueryDataManager(models.Manager):
 
     def get_for(self, handler, data):
         """Returns QueryData instance for given handler and data"""
+        return self.get_for_many(handler, [data])[0]
+
+    def get_for_many(self, handler, datas):
+        """
+        Returns QueryData instances for given handler and each of datas,
+        in the same order.
+
+        Existing rows are fetched with one query, missing ones are created
+        with one more insert.
+        """
+        from notification.matching import index_query_data
         if not isinstance(handler, string_types):
             if not isinstance(handler, type):
                 handler = type(handler)
             handler = "{0}.{1}".format(handler.__module__, handler.__name__)
-        data = self.prepare_data(data)
-        try:
-            return self.get(
-                handler=handler,
-                hash=self.make_hash(data)
-            )
-        except self.model.DoesNotExist:
-            obj = self.model()
-            obj.handler = handler
-            obj.data = data
-            obj.save()
-            return obj
+        datas = [self.prepare_data(data) for data in datas]
+        hashes = [self.make_hash(data) for data in datas]
+        if not hashes:
+            return []
+        found = dict(
+            (obj.hash, obj) for obj in self.filter(handler=handler, hash__in=set(hashes))
+        )
+        missing = {}
+        for hash, data in zip(hashes, datas):
+            if hash not in found and hash not in missing:
+                obj = self.model()
+                obj.handler = handler
+                obj.data = data
+                missing[hash] = obj
+        if missing:
+            sid = transaction.savepoint()
+            try:
+                self.bulk_create(list(missing.values()))
+                transaction.savepoint_commit(sid)
+                bulk_created = True
+            except IntegrityError:
+                # Some of them were created concurrently, create the others.
+                # save() indexes the rows it creates, and the concurrent
+                # creators indexed theirs.
+                transaction.savepoint_rollback(sid)
+                bulk_created = False
+                for obj in missing.values():
+                    sid = transaction.savepoint()
+                    try:
+                        obj.save()
+                        transaction.savepoint_commit(sid)
+                    except IntegrityError:
+                        transaction.savepoint_rollback(sid)
+            # bulk_create() does not set primary keys.
+            created = list(self.filter(handler=handler, hash__in=list(missing.keys())))
+            if bulk_created:
+                index_query_data(created)
+            found.update((obj.hash, obj) for obj in created)
+        return [found[hash] for hash in hashes]
+
+    def rehash(self):
+        """
+        Recomputes the hash of all rows, e.g. after the hash function changed.
+
+        Rows which turn out to have the same handler and data are merged into
+        the oldest one, and their observers are moved to it.
+        Returns the number of updated and of deleted rows.
+        """
+        from notification.index import observation_index
+        from notification.models import ObservedItem, ObserverCount
+        from notification.utils import loads_data
+        groups = {}
+        rows = self.order_by("pk").values_list("pk", "handler", "hash", "pickled_data")
+        for pk, handler, old_hash, pickled_data in rows.iterator():
+            new_hash = self.make_hash(loads_data(pickled_data))
+            groups.setdefault((handler, new_hash), []).append((pk, old_hash))
+
+        content_type = ContentType.objects.get_for_model(self.model)
+        updated = deleted = 0
+        for (handler, new_hash), group in groups.items():
+            (pk, old_hash), duplicates = group[0], [row[0] for row in group[1:]]
+            if duplicates:
+                observers = set(ObservedItem.objects.filter_for(
+                    content_type, [pk]
+                ).values_list("user", "signal"))
+                moved = ObservedItem.objects.filter_for(content_type, duplicates)
+                for item in moved:
+                    if (item.user_id, item.signal) in observers:
+                        item.delete()
+                    else:
+                        observers.add((item.user_id, item.signal))
+                        item.object_id = str(pk)
+                        item.save()
+                ObserverCount.objects.recount(content_type, [pk] + duplicates)
+                self.filter(pk__in=duplicates).delete()
+                deleted += len(duplicates)
+            if new_hash != old_hash:
+                self.filter(pk=pk).update(hash=new_hash)
+                updated += 1
+        if deleted:
+            # Observers were moved to other objects.
+            observation_index.invalidate()
+        return updated, deleted
 
     def make_hash(self, obj):
         """
-        Makes a hash from a dictionary, list, tuple or set to any level, that
-        contains only other hashable types (including any lists, tuples, sets,
-        and dictionaries).
+        Makes a signed 64-bit hash from a dictionary, list, tuple or set to any
+        level. Lists and tuples are compared regardless of the order of their
+        items, as before.
+
+        Unlike the built-in hash(), the result does not depend on the process
+        (hash randomization) or the Python version.
         """
+        digest = hashlib.md5(self.canonical_data(obj).encode("utf-8")).digest()
+        return struct.unpack(b"<q", digest[:8])[0]
+
+    def canonical_data(self, obj):
+        """Returns a canonical string representation of data."""
         if isinstance(obj, (tuple, list)):
-            return tuple(sorted([self.make_hash(e) for e in obj]))
+            return "[{0}]".format(",".join(sorted(self.canonical_data(e) for e in obj)))
 
-        elif isinstance(obj, set):
-            return frozenset([self.make_hash(e) for e in obj])
+        elif isinstance(obj, (set, frozenset)):
+            return "s[{0}]".format(",".join(sorted(self.canonical_data(e) for e in obj)))
 
         elif isinstance(obj, dict):
-            new_obj = {}
-            for k, v in obj.items():
-                new_obj[k] = self.make_hash(v)
-            return hash(frozenset(new_obj.items()))
+            return "{{{0}}}".format(",".join(sorted(
+                "{0}:{1}".format(self.canonical_data(k), self.canonical_data(v))
+                for k, v in obj.items()
+            )))
+
+        elif obj is None or isinstance(obj, string_types + integer_types + (float, )):
+            return json.dumps(obj)
 
-        return hash(obj)
+        return json.dumps("{0}:{1}".format(type(obj).__name__, obj))
 
     def prepare_data(self, obj):
         """Prepares data."""
@@ -154,7 +509,7 @@ class QueryDataManager(models.Manager):
                 new_v = self.prepare_data(v)
                 if new_v in ignored_values:
                     continue
-                new_obj[k] = self.prepare_data(v)
+                new_obj[k] = new_v
             return new_obj
 
         elif isinstance(obj, models.Model):
@@ -0,0 +1,155 @@
+from __future__ import absolute_import, unicode_literals
+from functools import reduce
+import hashlib
+import logging
+import operator
+
+from django.db import models
+from django.db.models import Q
+from django.db.models.fields import FieldDoesNotExist
+
+from notification.models import (QueryData, QueryDataTerm, get_handler_class,
+    send_observation_notices_for)
+
+try:
+    str = unicode  # Python 2.* compatible
+    string_types = (basestring,)
+except NameError:
+    string_types = (str,)
+
+# Matches saved searches (QueryData) against objects without evaluating
+# every saved search.
+#
+# A QueryData handler opts in by listing the data keys which are compared
+# with object attributes of the same name::
+#
+#     class AdsSearch(object):
+#         indexed_fields = ("category", "city", "type")
+#
+# The values of these keys are kept in QueryDataTerm, indexed by
+# (field, value). A saved search matches an object if, for each indexed key
+# of its data, one of its values equals the object value. Values of other
+# keys are only checked if the handler instance has a matches(obj) method.
+#
+# A handler can define get_object_terms(obj), returning a dict of field to
+# value(s), to compute object values in another way.
+#
+# Values longer than QueryDataTerm.value are replaced with their digest, on
+# both sides, so that they are still indexed and compared.
+
+VALUE_MAX_LENGTH = QueryDataTerm._meta.get_field("value").max_length
+
+logger = logging.getLogger(__name__)
+
+
+def _as_value(value):
+    value = str(value.pk if isinstance(value, models.Model) else value)
+    if len(value) > VALUE_MAX_LENGTH:
+        value = "md5:" + hashlib.md5(value.encode("utf-8")).hexdigest()
+    return value
+
+
+def _as_values(value):
+    if isinstance(value, (tuple, list, set, frozenset)):
+        values = value
+    else:
+        values = [value]
+    return set(_as_value(v) for v in values)
+
+
+def get_data_terms(handler, data):
+    """Returns a dict of field to the set of values of a saved search."""
+    terms = {}
+    if not isinstance(data, dict):
+        return terms
+    for field in getattr(handler, "indexed_fields", ()):
+        if field in data:
+            terms[field] = _as_values(data[field])
+    return terms
+
+
+def get_object_terms(handler, obj):
+    """Returns a dict of field to the set of values of an object."""
+    if hasattr(handler, "get_object_terms"):
+        terms = handler.get_object_terms(obj)
+    else:
+        terms = {}
+        for field in getattr(handler, "indexed_fields", ()):
+            try:
+                # Read the raw foreign key value, without a query.
+                terms[field] = getattr(obj, obj._meta.get_field(field).attname)
+            except FieldDoesNotExist:
+                terms[field] = getattr(obj, field, None)
+    return dict((field, _as_values(value)) for field, value in terms.items())
+
+
+def index_query_data(query_datas):
+    """
+    (Re)builds the terms of the given saved searches. Those whose handler
+    can't be imported are left without terms.
+    """
+    query_datas = list(query_datas)
+    QueryDataTerm.objects.filter(query_data__in=[qd.pk for qd in query_datas]).delete()
+    terms = []
+    for query_data in query_datas:
+        try:
+            handler = get_handler_class(query_data.handler)
+        except (ImportError, AttributeError, ValueError) as e:
+            # Left without terms, the search stays a candidate of every object.
+            logger.warning("Can't index query data {0} since {1}".format(query_data.pk, e))
+            continue
+        for field, values in get_data_terms(handler, query_data.data).items():
+            for value in values:
+                terms.append(QueryDataTerm(query_data=query_data, field=field, value=value))
+    QueryDataTerm.objects.bulk_create(terms)
+
+
+def match_query_data(obj, handler):
+    """Returns the saved searches of handler which match obj."""
+    if not isinstance(handler, string_types):
+        handler = "{0}.{1}".format(handler.__module__, handler.__name__)
+    handler_class = get_handler_class(handler)
+    object_terms = get_object_terms(handler_class, obj)
+
+    # Candidates share at least one term with the object,
+    # or have no indexed terms at all.
+    lookups = [
+        Q(field=field, value=value)
+        for field, values in object_terms.items()
+        for value in values
+    ]
+    pks = set()
+    if lookups:
+        pks.update(QueryDataTerm.objects.filter(
+            query_data__handler=handler
+        ).filter(reduce(operator.or_, lookups)).values_list("query_data", flat=True))
+    pks.update(QueryData.objects.filter(
+        handler=handler, terms__isnull=True
+    ).values_list("pk", flat=True))
+
+    matched = []
+    for query_data in QueryData.objects.filter(pk__in=pks):
+        data_terms = get_data_terms(handler_class, query_data.data)
+        if not all(values & object_terms.get(field, set())
+                   for field, values in data_terms.items()):
+            continue
+        matches = getattr(query_data.handler_instance, "matches", None)
+        if matches is not None and not matches(obj):
+            continue
+        matched.append(query_data)
+    return matched
+
+
+def send_query_data_notices_for(obj, handler, signal="post_save",
+                                extra_context=None, on_site=True, sender=None):
+    """
+    Sends observation notices to the observers of all saved searches of
+    handler which match obj. obj is passed as ``context_object``.
+    """
+    if extra_context is None:
+        extra_context = {}
+    matched = match_query_data(obj, handler)
+    for query_data in matched:
+        context = dict(extra_context, context_object=obj)
+        send_observation_notices_for(query_data, signal, context, on_site, sender)
+    return matched
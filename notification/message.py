@@ -1,6 +1,15 @@
 from __future__ import absolute_import, unicode_literals
-from django.db.models import get_model
-from django.utils.translation import ugettext
+import hashlib
+import re
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import get_model, signals
+from django.utils.translation import ugettext, get_language
+
+# seconds to cache decoded messages, 0 disables the cache
+CACHE_TIMEOUT = getattr(settings, "NOTIFICATION_MESSAGE_CACHE_TIMEOUT", 0)
 
 # a notice like "foo and bar are now friends" is stored in the database
 # as "{auth.User.5} and {auth.User.7} are now friends".
@@ -19,6 +28,14 @@ from django.utils.translation import ugettext
 #
 # message_to_text and message_to_html use decode_message to produce a
 # text and html version of the message respectively.
+#
+# messages_to_text and messages_to_html do the same for many messages,
+# fetching all referenced objects with one query per model.
+#
+# If NOTIFICATION_MESSAGE_CACHE_TIMEOUT is set, the results of all four are
+# cached per message, language and output kind. Each referenced object has a
+# version in the cache, which is part of the cache keys of the messages
+# referencing it; saving or deleting the object replaces its version.
 
 def encode_object(obj, name=None):
     encoded = "{0}.{1}.{2}".format(obj._meta.app_label, obj._meta.object_name, obj.pk)
@@ -50,38 +67,57 @@ class FormatException(Exception):
     pass
 
 
-def decode_message(message, decoder):
-    out = []
+_REFERENCE_RE = re.compile(r"\{([^{}]*)\}")
+_BRACE_RE = re.compile(r"[{}]")
+
+
+def _check_literal(message, start, end):
+    """Raises FormatException for a brace in message[start:end]."""
+    match = _BRACE_RE.search(message, start, end)
+    if match is None:
+        return
+    if match.group() == "}":
+        raise FormatException("unmatched }")
+    if message.find("{", match.end()) != -1:
+        raise FormatException("{ inside {}")
+    raise FormatException("unmatched {")
+
+
+def parse_message(message):
+    """
+    Splits an encoded message into a list of literal strings and a list of
+    references, so that literals[0] + refs[0] + literals[1] + ... + literals[-1]
+    is the message with the braces of the references removed.
+    """
+    literals = []
+    refs = []
+    prev = 0
+    for match in _REFERENCE_RE.finditer(message):
+        _check_literal(message, prev, match.start())
+        literals.append(message[prev:match.start()])
+        refs.append(match.group(1))
+        prev = match.end()
+    _check_literal(message, prev, len(message))
+    literals.append(message[prev:])
+    return literals, refs
+
+
+def _format_message(literals, decoded):
+    """
+    Joins the parsed literals with the decoded ``(obj, msgid)`` pairs
+    of the references and translates the result.
+    """
+    out = [literals[0]]
     objects = []
     mapping = {}
-    in_field = False
-    prev = 0
-    for index, ch in enumerate(message):
-        if not in_field:
-            if ch == "{":
-                in_field = True
-                if prev != index:
-                    out.append(message[prev:index])
-                prev = index
-            elif ch == "}":
-                raise FormatException("unmatched }")
-        elif in_field:
-            if ch == "{":
-                raise FormatException("{ inside {}")
-            elif ch == "}":
-                in_field = False
-                obj, msgid = decoder(message[prev+1:index])
-                if msgid is None:
-                    objects.append(obj)
-                    out.append("%s")
-                else:
-                    mapping[msgid] = obj
-                    out.append("%("+msgid+")s")
-                prev = index + 1
-    if in_field:
-        raise FormatException("unmatched {")
-    if prev <= index:
-        out.append(message[prev:index+1])
+    for (obj, msgid), literal in zip(decoded, literals[1:]):
+        if msgid is None:
+            objects.append(obj)
+            out.append("%s")
+        else:
+            mapping[msgid] = obj
+            out.append("%("+msgid+")s")
+        out.append(literal)
     result = "".join(out)
     if mapping:
         args = mapping
@@ -90,19 +126,140 @@ def decode_message(message, decoder):
     return ugettext(result) % args
 
 
-def message_to_text(message):
-    def decoder(ref):
-        obj, msgid = decode_object(ref)
-        return str(obj), msgid
-    return decode_message(message, decoder)
+def decode_message(message, decoder):
+    literals, refs = parse_message(message)
+    return _format_message(literals, [decoder(ref) for ref in refs])
 
 
-def message_to_html(message):
+def decode_messages(messages, formatter):
+    """
+    Decodes many messages at once. The referenced objects are fetched with
+    one query per model, and converted to strings with formatter(obj).
+    """
+    parsed = [parse_message(message) for message in messages]
+    pks = {}
+    for literals, refs in parsed:
+        for ref in refs:
+            app, name, pk = ref.split(".")[:3]
+            pks.setdefault((app, name), set()).add(pk)
+    models = {}
+    objects = {}
+    for (app, name), model_pks in pks.items():
+        model = models[(app, name)] = get_model(app, name)
+        pk_field = model._meta.pk
+        by_pk = model._default_manager.in_bulk([pk_field.to_python(pk) for pk in model_pks])
+        for pk in model_pks:
+            objects[(app, name, pk)] = by_pk.get(pk_field.to_python(pk))
+
     def decoder(ref):
-        obj, msgid = decode_object(ref)
-        if hasattr(obj, "get_absolute_url"): # don't fail silenty if get_absolute_url hasn't been defined
-            return """<a href="{0}">{1}</a>""".format(obj.get_absolute_url(), str(obj)), msgid
+        decoded = ref.split(".")
+        if len(decoded) == 4:
+            app, name, pk, msgid = decoded
         else:
-            return str(obj), msgid
-    return decode_message(message, decoder)
-    
+            app, name, pk = decoded
+            msgid = None
+        obj = objects[(app, name, pk)]
+        if obj is None:
+            model = models[(app, name)]
+            raise model.DoesNotExist(
+                "{0} matching query does not exist.".format(model._meta.object_name))
+        return formatter(obj), msgid
+
+    return [
+        _format_message(literals, [decoder(ref) for ref in refs])
+        for literals, refs in parsed
+    ]
+
+
+def _to_text(obj):
+    return str(obj)
+
+
+def _to_html(obj):
+    if hasattr(obj, "get_absolute_url"): # don't fail silenty if get_absolute_url hasn't been defined
+        return """<a href="{0}">{1}</a>""".format(obj.get_absolute_url(), str(obj))
+    return str(obj)
+
+
+def _cache_key(message, kind, versions):
+    digest = hashlib.md5("|".join([message] + versions).encode("utf-8")).hexdigest()
+    return "notification.message.{0}.{1}.{2}".format(kind, get_language(), digest)
+
+
+def _version_cache_key(app, name, pk):
+    return "notification.message.version.{0}.{1}.{2}".format(app, name, pk)
+
+
+def _ref_version_keys(message):
+    return [_version_cache_key(*ref.split(".")[:3]) for ref in parse_message(message)[1]]
+
+
+def _get_versions(version_keys):
+    """Returns the versions of the given keys, adding the missing ones."""
+    versions = cache.get_many(version_keys)
+    for version_key in version_keys:
+        if version_key not in versions:
+            version = uuid.uuid4().hex
+            # Another process may have added it first.
+            if not cache.add(version_key, version, CACHE_TIMEOUT):
+                version = cache.get(version_key) or version
+            versions[version_key] = version
+    return versions
+
+
+def _decode_cached(messages, kind, formatter):
+    """
+    Returns decode_messages(messages, formatter), taking the messages
+    decoded before from the cache.
+    """
+    if not CACHE_TIMEOUT:
+        return decode_messages(messages, formatter)
+    messages = list(messages)
+    message_version_keys = [_ref_version_keys(message) for message in messages]
+    versions = _get_versions(list(set(
+        version_key for version_keys in message_version_keys for version_key in version_keys
+    )))
+    keys = [
+        _cache_key(message, kind, [versions[version_key] for version_key in version_keys])
+        for message, version_keys in zip(messages, message_version_keys)
+    ]
+    decoded = cache.get_many(keys)
+    missing = {}
+    for message, key in zip(messages, keys):
+        if key not in decoded:
+            missing[key] = message
+    if missing:
+        missing_keys = list(missing.keys())
+        values = decode_messages([missing[key] for key in missing_keys], formatter)
+        values = dict(zip(missing_keys, values))
+        cache.set_many(values, CACHE_TIMEOUT)
+        decoded.update(values)
+    return [decoded[key] for key in keys]
+
+
+def _invalidate(sender, instance, **kwargs):
+    # The next lookup adds a new version, so that the messages cached with
+    # the previous one are not found anymore, and expire.
+    cache.delete(_version_cache_key(instance._meta.app_label, instance._meta.object_name, instance.pk))
+
+if CACHE_TIMEOUT:
+    signals.post_save.connect(_invalidate, dispatch_uid="notification.message.invalidate")
+    signals.post_delete.connect(_invalidate, dispatch_uid="notification.message.invalidate")
+
+
+def message_to_text(message):
+    return _decode_cached([message], "text", _to_text)[0]
+
+
+def message_to_html(message):
+    return _decode_cached([message], "html", _to_html)[0]
+
+
+def messages_to_text(messages):
+    """message_to_text for many messages, see decode_messages."""
+    return _decode_cached(messages, "text", _to_text)
+
+
+def messages_to_html(messages):
+    """message_to_html for many messages, see decode_messages."""
+    return _decode_cached(messages, "html", _to_html)
@@ -0,0 +1,30 @@
+from __future__ import absolute_import, unicode_literals
+from notification import deferred
+
+
+class DeferredObservationNoticesMiddleware(object):
+    """
+    Defers the observation notices sent during a request until the response,
+    and sends them once per (object, signal). Nothing is sent if the view
+    raises an exception.
+
+    Put it before ``django.middleware.transaction.TransactionMiddleware``
+    in ``MIDDLEWARE_CLASSES``, so that notices are sent after the commit.
+    """
+
+    def process_request(self, request):
+        # A block left open by a broken request must not leak into this one.
+        deferred.reset()
+        deferred.begin()
+        request._notification_deferred = True
+
+    def process_exception(self, request, exception):
+        if getattr(request, "_notification_deferred", False):
+            request._notification_deferred = False
+            deferred.rollback()
+
+    def process_response(self, request, response):
+        if getattr(request, "_notification_deferred", False):
+            request._notification_deferred = False
+            deferred.commit()
+        return response
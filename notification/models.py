@@ -1,19 +1,19 @@
 from __future__ import absolute_import, unicode_literals
-import sys
-
-try:
-    import cPickle as pickle
-except ImportError:
-    import pickle
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from datetime import timedelta
 
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
-from django.core.exceptions import ImproperlyConfigured, PermissionDenied
+from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist, PermissionDenied
 from django.core.urlresolvers import reverse
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.db.models.query import QuerySet, RawQuerySet
 from django.template.loader import render_to_string
+from django.utils.importlib import import_module
 from django.utils.translation import ugettext_lazy as _
 from django.utils import translation
 from django.utils import timezone
@@ -21,10 +21,16 @@ from django.utils import timezone
 from django.contrib.auth.models import User
 
 from notification import backends
+from notification import deferred
+from notification.index import observation_index
+from notification.queues import get_queue_storage
 from notification.message import encode_message
-from notification.managers import NoticeManager, ObservedItemManager, QueryDataManager
-from notification.signals import should_deliver, delivered, configure
-from notification.utils import permission_by_label
+from notification.managers import (NoticeManager, ObservedItemManager,
+    ObserverCountManager, QueryDataManager, to_int_object_id)
+from notification.signals import (should_deliver, delivered, configure,
+    should_deliver_many, configure_many, delivered_many, has_receivers)
+from notification.utils import (permission_by_label, dumps_data, loads_data,
+    filter_users_with_perm, filter_objects_with_perm)
 
 try:
     str = unicode  # Python 2.* compatible
@@ -35,6 +41,17 @@ except NameError:
     integer_types = (int,)
 
 QUEUE_ALL = getattr(settings, "NOTIFICATION_QUEUE_ALL", False)
+# max number of recipients in one queued batch of observation notices
+RECIPIENTS_PER_BATCH = getattr(settings, "NOTIFICATION_RECIPIENTS_PER_BATCH", 1000)
+# max number of rows inserted or looked up by one query of the bulk functions
+BULK_SIZE = 500
+# seconds the languages and timezones of NOTIFICATION_LANGUAGE_MODULE are
+# cached per process, 0 to disable the cache
+LANGUAGE_CACHE_TIMEOUT = getattr(settings, "NOTIFICATION_LANGUAGE_CACHE_TIMEOUT", 300)
+# max number of users in this cache
+LANGUAGE_CACHE_SIZE = 10000
+
+logger = logging.getLogger(__name__)
 
 
 class LanguageStoreNotAvailable(Exception):
@@ -50,6 +67,13 @@ class NoticeType(models.Model):
     # by default only on for media with sensitivity less than or equal to this number
     default = models.IntegerField(_("default"))
 
+    # notices of this type about the same object sent to a recipient within
+    # this number of seconds are merged, 0 to disable
+    coalesce_window = models.PositiveIntegerField(_("coalesce window"), default=0)
+
+    # default priority of the queued notices of this type, higher first
+    priority = models.IntegerField(_("priority"), default=0)
+
     def __str__(self):
         return self.label
 
@@ -59,14 +83,15 @@ class NoticeType(models.Model):
         verbose_name_plural = _("notice types")
 
 
-NOTIFICATION_BACKENDS = backends.load_backends()
+# backends are imported and instantiated on first use
+NOTIFICATION_BACKENDS = backends.LazyMapping(backends.load_backends)
 
-NOTICE_MEDIA = []
-NOTICE_MEDIA_DEFAULTS = {}
-for key, backend in list(NOTIFICATION_BACKENDS.items()):
-    # key is a tuple (medium_id, backend_label)
-    NOTICE_MEDIA.append(key)
-    NOTICE_MEDIA_DEFAULTS[key[0]] = backend.spam_sensitivity
+# (medium_id, backend_label) pairs, read from the settings only
+NOTICE_MEDIA = backends.get_notice_media()
+NOTICE_MEDIA_DEFAULTS = backends.LazyMapping(lambda: dict(
+    (medium_id, backend.spam_sensitivity)
+    for (medium_id, backend_label), backend in NOTIFICATION_BACKENDS.items()
+))
 
 
 class NoticeSetting(models.Model):
@@ -96,10 +121,50 @@ def get_notification_setting(user, notice_type, medium):
         return setting
 
 
+def get_notification_settings(users, notice_type, medium):
+    """
+    Returns a dict of NoticeSettings of the given users, keyed by user id.
+    Missing settings are created with the default value.
+    """
+    notice_settings = {}
+    for users_part in _chunked(users, BULK_SIZE):
+        user_ids = set(user.pk for user in users_part)
+        notice_settings.update((setting.user_id, setting) for setting in NoticeSetting.objects.filter(
+            user__in=user_ids, notice_type=notice_type, medium=medium
+        ))
+        missing = [user_id for user_id in user_ids if user_id not in notice_settings]
+        if not missing:
+            continue
+        default = (NOTICE_MEDIA_DEFAULTS[medium] <= notice_type.default)
+        created = [
+            NoticeSetting(user_id=user_id, notice_type=notice_type, medium=medium, send=default)
+            for user_id in missing
+        ]
+        sid = transaction.savepoint()
+        try:
+            NoticeSetting.objects.bulk_create(created)
+            transaction.savepoint_commit(sid)
+        except IntegrityError:
+            # Some of them were created concurrently.
+            transaction.savepoint_rollback(sid)
+            created = [
+                get_notification_setting(User(pk=user_id), notice_type, medium)
+                for user_id in missing
+            ]
+        notice_settings.update((setting.user_id, setting) for setting in created)
+    return notice_settings
+
+
 def should_send(user, notice_type, medium):
     return get_notification_setting(user, notice_type, medium).send
 
 
+def should_send_many(users, notice_type, medium):
+    """Returns a dict of should_send() results, keyed by user id."""
+    notice_settings = get_notification_settings(users, notice_type, medium)
+    return dict((user_id, setting.send) for user_id, setting in notice_settings.items())
+
+
 class NoticeUid(models.Model):
     """Prevents duplicates for same object by differents observed items"""
     recipient = models.ForeignKey(User, related_name="recieved_noticesuid", verbose_name=_("recipient"))
@@ -124,6 +189,9 @@ class Notice(models.Model):
     unseen = models.BooleanField(_("unseen"), default=True, db_index=True)
     archived = models.BooleanField(_("archived"), default=False, db_index=True)
     on_site = models.BooleanField(_("on site"), db_index=True)
+    # number of notices merged in this one, see NoticeType.coalesce_window
+    count = models.PositiveIntegerField(_("count"), default=1)
+    coalesce_key = models.CharField(_("coalesce key"), max_length=32, blank=True, db_index=True)
 
     objects = NoticeManager()
 
@@ -162,14 +230,49 @@ class NoticeQueueBatch(models.Model):
     Denormalized data for a notice.
     """
     pickled_data = models.TextField()
+    # lane of the batch, higher lanes are sent first
+    priority = models.IntegerField(default=0)
+    # the batch may be dropped after this time under backlog
+    expires = models.DateTimeField(null=True, blank=True)
+    # the batch is sent after this time
+    not_before = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        index_together = (
+            ("priority", "not_before"),
+        )
 
 
-def create_notice_type(label, display, description, default=2, verbosity=1):
+class DigestItem(models.Model):
+    """
+    A notice buffered by the digest backend, until the digest of its
+    recipient and medium is sent.
+    """
+    user = models.ForeignKey(User, verbose_name=_("user"))
+    medium = models.CharField(_("medium"), max_length=1)
+    notice_type = models.ForeignKey(NoticeType, verbose_name=_("notice type"))
+    message = models.TextField(_("message"))
+    added = models.DateTimeField(_("added"), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("digest item")
+        verbose_name_plural = _("digest items")
+        index_together = (
+            ("medium", "added"),
+            ("medium", "user"),
+        )
+
+
+def create_notice_type(label, display, description, default=2, verbosity=1,
+                       coalesce_window=None):
     """
     Creates a new NoticeType.
 
     This is intended to be used by other apps as a post_syncdb manangement step.
     """
+    extra = {}
+    if coalesce_window is not None:
+        extra["coalesce_window"] = coalesce_window
     try:
         notice_type = NoticeType.objects.get(label=label)
         updated = False
@@ -182,32 +285,94 @@ def create_notice_type(label, display, description, default=2, verbosity=1):
         if default != notice_type.default:
             notice_type.default = default
             updated = True
+        if coalesce_window is not None and coalesce_window != notice_type.coalesce_window:
+            notice_type.coalesce_window = coalesce_window
+            updated = True
         if updated:
             notice_type.save()
             if verbosity > 1:
                 print("Updated {0} NoticeType".format(label))
     except NoticeType.DoesNotExist:
-        NoticeType(label=label, display=display, description=description, default=default).save()
+        NoticeType(label=label, display=display, description=description, default=default, **extra).save()
         if verbosity > 1:
             print("Created {0} NoticeType".format(label))
 
 
+# user id -> (expiry time, (language, timezone) or None)
+_language_cache = {}
+
+
+def _invalidate_language(sender, instance, **kwargs):
+    _language_cache.pop(getattr(instance, "user_id", None), None)
+
+
+def get_language_model():
+    """
+    Returns the model of the NOTIFICATION_LANGUAGE_MODULE setting. Raises
+    LanguageStoreNotAvailable if this site does not use translated
+    notifications.
+    """
+    if not getattr(settings, "NOTIFICATION_LANGUAGE_MODULE", False):
+        raise LanguageStoreNotAvailable
+    try:
+        app_label, model_name = settings.NOTIFICATION_LANGUAGE_MODULE.split(".")
+        model = models.get_model(app_label, model_name)
+    except (ValueError, ImportError, ImproperlyConfigured):
+        raise LanguageStoreNotAvailable
+    if model is None:
+        raise LanguageStoreNotAvailable
+    for signal in (models.signals.post_save, models.signals.post_delete):
+        signal.connect(_invalidate_language, sender=model,
+                       dispatch_uid="notification.models.invalidate_language")
+    return model
+
+
+def get_notification_languages(users):
+    """
+    Returns a dict of user id to a (language, timezone) pair, read from the
+    model of the NOTIFICATION_LANGUAGE_MODULE setting with a query per
+    batch of users. language or timezone is None if the model has no such
+    field; users without language store are missing from the dict.
+
+    Raises LanguageStoreNotAvailable if this site does not use translated
+    notifications.
+    """
+    model = get_language_model()
+    now = time.time()
+    result = {}
+    missing = set()
+    for user in users:
+        cached = _language_cache.get(user.pk)
+        if cached is not None and cached[0] > now:
+            result[user.pk] = cached[1]
+        else:
+            missing.add(user.pk)
+    if LANGUAGE_CACHE_TIMEOUT and len(_language_cache) + len(missing) > LANGUAGE_CACHE_SIZE:
+        _language_cache.clear()
+    for user_ids in _chunked(missing, BULK_SIZE):
+        found = {}
+        for language_model in model._default_manager.filter(user__in=user_ids):
+            found[language_model.user_id] = (
+                getattr(language_model, "language", None),
+                getattr(language_model, "timezone", None) or None,
+            )
+        for user_id in user_ids:
+            result[user_id] = found.get(user_id)
+            if LANGUAGE_CACHE_TIMEOUT:
+                _language_cache[user_id] = (now + LANGUAGE_CACHE_TIMEOUT, result[user_id])
+    return dict((user_id, value) for user_id, value in result.items() if value is not None)
+
+
 def get_notification_language(user):
     """
     Returns site-specific notification language for this user. Raises
     LanguageStoreNotAvailable if this site does not use translated
     notifications.
     """
-    if getattr(settings, "NOTIFICATION_LANGUAGE_MODULE", False):
-        try:
-            app_label, model_name = settings.NOTIFICATION_LANGUAGE_MODULE.split(".")
-            model = models.get_model(app_label, model_name)
-            language_model = model._default_manager.get(user__id__exact=user.id)
-            if hasattr(language_model, "language"):
-                return language_model.language
-        except (ImportError, ImproperlyConfigured, model.DoesNotExist):
-            raise LanguageStoreNotAvailable
-    raise LanguageStoreNotAvailable
+    language, tz = get_notification_languages([user]).get(user.pk, (None, None))
+    if language is None:
+        raise LanguageStoreNotAvailable
+    return language
 
 
 def get_formatted_messages(formats, label, context):
@@ -252,57 +417,105 @@ def send_now(users, label, extra_context=None, on_site=True, sender=None):
     current_language = translation.get_language()
     current_timezone = timezone.get_current_timezone()
 
-    for user in users:
-        obj = extra_context.get('context_object',
-                                extra_context.get('observed', None))
-        if obj and not user.has_perm(permission_by_label(obj, 'view'), obj):
-            continue
+    # get languages and timezones of users from language store defined in
+    # NOTIFICATION_LANGUAGE_MODULE setting, with one query per batch
+    users = list(users)
+    try:
+        user_languages = get_notification_languages(users)
+    except LanguageStoreNotAvailable:
+        user_languages = {}
 
-        if notice_uid:
-            try:
-                NoticeUid.objects.get(notice_uid=notice_uid, recipient=user)
-                continue
-            except NoticeUid.DoesNotExist:
-                NoticeUid.objects.create(notice_uid=notice_uid, recipient=user)
+    # The per-recipient signals are only sent to legacy receivers.
+    send_should_deliver = has_receivers(should_deliver, Notice)
+    send_configure = has_receivers(configure, Notice)
+    send_delivered = has_receivers(delivered, Notice)
 
-        # Deprecated
-        # get user language for user from language store defined in
-        # NOTIFICATION_LANGUAGE_MODULE setting
+    candidates = []
+    for user in users:
         try:
-            language = get_notification_language(user)
-        except LanguageStoreNotAvailable:
-            language = None
+            obj = extra_context.get('context_object',
+                                    extra_context.get('observed', None))
+            if obj and not user.has_perm(permission_by_label(obj, 'view'), obj):
+                continue
 
-        # Deprecated
-        result = {'pass': True}
-        results = should_deliver.send(
+            if notice_uid:
+                try:
+                    NoticeUid.objects.get(notice_uid=notice_uid, recipient=user)
+                    continue
+                except NoticeUid.DoesNotExist:
+                    NoticeUid.objects.create(notice_uid=notice_uid, recipient=user)
+
+            language, tz = user_languages.get(user.pk, (None, None))
+
+            if send_should_deliver:
+                # Deprecated
+                result = {'pass': True}
+                results = should_deliver.send(
+                    sender=Notice,
+                    result=result,
+                    recipient=user,
+                    label=label,
+                    notice_type=notice_type,
+                    extra_context=extra_context,
+                    sender_user=sender
+                )
+                if not result['pass']:
+                    continue
+                if False in [i[1] for i in results]:
+                    continue
+
+            configs = []
+            if send_configure:
+                results = configure.send(
+                    sender=Notice,
+                    recipient=user,
+                    label=label,
+                    notice_type=notice_type,
+                    extra_context=extra_context,
+                    sender_user=sender
+                )
+                configs = [i[1] for i in results if i[1]]
+
+            candidates.append((user, language, tz, configs))
+        except ObjectDoesNotExist as e:
+            # One bad recipient does not stop the others.
+            logger.warning("Can't to emit notice {0} to user {1} since {2}".format(label, user, e))
+
+    if candidates and has_receivers(should_deliver_many, Notice):
+        results = should_deliver_many.send(
             sender=Notice,
-            result=result,
-            recipient=user,
+            recipients=[user for user, language, tz, configs in candidates],
             label=label,
             notice_type=notice_type,
             extra_context=extra_context,
             sender_user=sender
         )
-        if not result['pass']:
-            continue
-        if False in [i[1] for i in results]:
-            continue
-
-        results = configure.send(
+        decisions = [i[1] for i in results if i[1]]
+        candidates = [
+            (user, language, tz, configs) for user, language, tz, configs in candidates
+            if all(decision.get(user.pk, True) for decision in decisions)
+        ]
+
+    if candidates and has_receivers(configure_many, Notice):
+        results = configure_many.send(
             sender=Notice,
-            recipient=user,
+            recipients=[user for user, language, tz, configs in candidates],
             label=label,
             notice_type=notice_type,
             extra_context=extra_context,
             sender_user=sender
         )
-        configs = [i[1] for i in results if i[1]]
+        user_configs = [i[1] for i in results if i[1]]
+        for user, language, tz, configs in candidates:
+            configs.extend(i[user.pk] for i in user_configs if i.get(user.pk))
+
+    recipients = []
+    for user, language, tz, configs in candidates:
         configs.sort(key=lambda x: x.get('order', 0))
         # TODO: Let pass config as argument of function, or as item of extra_context???
         config = {
             'language': language or current_language,
-            'timezone': current_timezone,
+            'timezone': tz or current_timezone,
             'send': True,
         }
         for i in configs:
@@ -311,26 +524,67 @@ def send_now(users, label, extra_context=None, on_site=True, sender=None):
         if not config['send']:
             continue
 
-        with translation.override(config['language']), timezone.override(config['timezone']):
+        recipients.append((user, config))
+
+    # Deliver to all recipients sharing a language and a timezone at once.
+    groups = OrderedDict()
+    for user, config in recipients:
+        groups.setdefault((config['language'], config['timezone']), []).append(user)
+
+    for (language, tz), group_users in groups.items():
+        with translation.override(language), timezone.override(tz):
             for (medium_id, backend_label), backend in list(NOTIFICATION_BACKENDS.items()):
-                if backend.can_send(user, notice_type):
-                    backend.deliver(user, sender, notice_type, extra_context)
-                    delivered.send(
-                        sender=Notice,
-                        recipient=user,
-                        notice_type=notice_type,
-                        extra_context=extra_context,
-                        sender_user=sender,
-                        medium_id=medium_id,
-                        backend_label=backend_label,
-                        backend=backend
-                    )
-                    sent.setdefault(backend_label, 0)
-                    sent[backend_label] += 1
+                allowed = backend.can_send_many(group_users, notice_type)
+                if not allowed:
+                    continue
+                results = backend.deliver_many(allowed, sender, notice_type, extra_context)
+                delivered_users = [user for user, result in results if result]
+                if not delivered_users:
+                    continue
+                if send_delivered:
+                    for user in delivered_users:
+                        delivered.send(
+                            sender=Notice,
+                            recipient=user,
+                            notice_type=notice_type,
+                            extra_context=extra_context,
+                            sender_user=sender,
+                            medium_id=medium_id,
+                            backend_label=backend_label,
+                            backend=backend
+                        )
+                delivered_many.send(
+                    sender=Notice,
+                    recipients=delivered_users,
+                    notice_type=notice_type,
+                    extra_context=extra_context,
+                    sender_user=sender,
+                    medium_id=medium_id,
+                    backend_label=backend_label,
+                    backend=backend
+                )
+                sent.setdefault(backend_label, 0)
+                sent[backend_label] += len(delivered_users)
 
     return sent
 
 
+def get_coalesce_key(recipient, notice_type, extra_context):
+    """
+    Returns the key shared by the notices of notice_type about the same
+    object (the context_object or observed item of extra_context) sent to
+    recipient, or None if these notices are not coalesced.
+    """
+    if not notice_type.coalesce_window:
+        return None
+    obj = extra_context.get('context_object', extra_context.get('observed', None))
+    if obj is None or not isinstance(obj, models.Model):
+        return None
+    content_type = ContentType.objects.get_for_model(obj)
+    key = "{0}:{1}:{2}:{3}".format(recipient.pk, notice_type.pk, content_type.pk, obj.pk)
+    return hashlib.md5(key.encode("utf-8")).hexdigest()
+
+
 def send(*args, **kwargs):
     """
     A basic interface around both queue and send_now. This honors a global
@@ -341,32 +595,60 @@ def send(*args, **kwargs):
     queue_flag = kwargs.pop("queue", False)
     now_flag = kwargs.pop("now", False)
     assert not (queue_flag and now_flag), "'queue' and 'now' cannot both be True."
+    # arguments of queue() only
+    queue_kwargs = dict((key, kwargs.pop(key)) for key in QUEUE_KWARGS if key in kwargs)
+    if queue_kwargs.get("not_before") is not None:
+        # scheduled notices are always queued
+        assert not now_flag, "'now' and 'not_before' cannot be used together."
+        queue_flag = True
     if queue_flag:
-        return queue(*args, **kwargs)
+        return queue(*args, **dict(kwargs, **queue_kwargs))
     elif now_flag:
         return send_now(*args, **kwargs)
     else:
         if QUEUE_ALL:
-            return queue(*args, **kwargs)
+            return queue(*args, **dict(kwargs, **queue_kwargs))
         else:
             return send_now(*args, **kwargs)
 
 
-def queue(users, label, extra_context=None, on_site=True, sender=None):
+QUEUE_KWARGS = ("priority", "expires", "not_before")
+
+
+def queue(users, label, extra_context=None, on_site=True, sender=None,
+          priority=None, expires=None, not_before=None):
     """
-    Queue the notification in NoticeQueueBatch. This allows for large amounts
+    Queue the notification in the queue storage (NoticeQueueBatch by
+    default, see NOTIFICATION_QUEUE_STORAGE). This allows for large amounts
     of user notifications to be deferred to a seperate process running outside
     the webserver.
+
+    priority is the lane of the batch, the priority of the notice type by
+    default. expires (a datetime or a timedelta from now) allows to drop the
+    batch under backlog, see NOTIFICATION_QUEUE_SHED_BACKLOG. not_before (a
+    datetime or a timedelta from now) delays the sending.
     """
     if extra_context is None:
         extra_context = {}
+    if priority is None:
+        priorities = NoticeType.objects.filter(label=label).values_list("priority", flat=True)[:1]
+        priority = priorities[0] if priorities else 0
+    if isinstance(expires, timedelta):
+        expires = timezone.now() + expires
+    if isinstance(not_before, timedelta):
+        not_before = timezone.now() + not_before
+    if not_before is None:
+        not_before = timezone.now()
     if isinstance(users, (QuerySet, RawQuerySet)):
         users = list(users.values_list("pk", flat=True))
         # users = users.query  # ???
     else:
         users = [u.pk if isinstance(u, models.Model) else u for u in users]
-    notices = [(users, label, extra_context, on_site, sender, ), ]
-    NoticeQueueBatch(pickled_data=pickle.dumps(notices).encode("base64")).save()
+    # split large sends, so that a lane can be interrupted between batches
+    get_queue_storage().enqueue([
+        [(users_part, label, extra_context, on_site, sender, ), ]
+        for users_part in _chunked(users, RECIPIENTS_PER_BATCH)
+    ], priority=priority, expires=expires, not_before=not_before)
 
 
 class ObservedItem(models.Model):
@@ -375,6 +657,8 @@ class ObservedItem(models.Model):
 
     content_type = models.ForeignKey(ContentType)
     object_id = models.CharField(max_length=255, db_index=True)
+    # object_id of integer primary keys, see NOTIFICATION_INT_OBJECT_IDS
+    object_int_id = models.BigIntegerField(null=True, blank=True)
     observed_object = generic.GenericForeignKey("content_type", "object_id")
 
     notice_type = models.ForeignKey(NoticeType, verbose_name=_("notice type"))
@@ -394,6 +678,14 @@ class ObservedItem(models.Model):
         ordering = ["-added"]
         verbose_name = _("observed item")
         verbose_name_plural = _("observed items")
+        index_together = [
+            ("content_type", "object_id", "signal", "user"),
+            ("content_type", "object_int_id", "signal", "user"),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.object_int_id = to_int_object_id(self.object_id)
+        super(ObservedItem, self).save(*args, **kwargs)
 
     def send_notice(self, extra_context=None):
         if extra_context is None:
@@ -402,6 +694,26 @@ class ObservedItem(models.Model):
         send([self.user], self.notice_type.label, extra_context)
 
 
+class ObserverCount(models.Model):
+    """
+    Denormalized number of observers of an object for a signal.
+
+    Maintained by observe(), stop_observing() and the bulk functions,
+    and recomputed by the reconcile_observer_counts command.
+    """
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.CharField(max_length=255)
+    signal = models.CharField(_("signal"), max_length=255)
+    count = models.IntegerField(_("count"), default=0)
+
+    objects = ObserverCountManager()
+
+    class Meta:
+        verbose_name = _("observer count")
+        verbose_name_plural = _("observer counts")
+        unique_together = (("content_type", "object_id", "signal"),)
+
+
 def observe(observed, observer, notice_type_label, signal="post_save"):
     """
     Create a new ObservedItem.
@@ -417,6 +729,7 @@ def observe(observed, observer, notice_type_label, signal="post_save"):
         notice_type=notice_type, signal=signal
     )
     observed_item.save()
+    ObserverCount.objects.add_for([observed_item])
     return observed_item
 
 
@@ -426,6 +739,150 @@ def stop_observing(observed, observer, signal="post_save"):
     """
     observed_item = ObservedItem.objects.get_for(observed, observer, signal)
     observed_item.delete()
+    ObserverCount.objects.add_for([observed_item], -1)
+
+
+def observe_many(observed, observers, notice_type_label, signal="post_save"):
+    """
+    Registers many users as observers of one object.
+
+    Users who are not allowed to view the object, or who already observe it,
+    are skipped. Returns the list of created ObservedItems.
+    """
+    perm = permission_by_label(observed, 'view')
+    notice_type = NoticeType.objects.get(label=notice_type_label)
+    content_type = ContentType.objects.get_for_model(observed)
+    object_id = str(observed.pk)
+    created = []
+    for observers_part in _chunked(observers, BULK_SIZE):
+        observers_part = filter_users_with_perm([
+            observer for observer in observers_part if observer.is_authenticated()
+        ], perm, observed)
+        existing = set(ObservedItem.objects.filter_for(
+            content_type, [object_id], signal=signal,
+            user__in=[observer.pk for observer in observers_part]
+        ).values_list("user", flat=True))
+        observed_items = []
+        for observer in observers_part:
+            if observer.pk in existing:
+                continue
+            existing.add(observer.pk)
+            observed_items.append(ObservedItem(
+                user=observer, content_type=content_type, object_id=object_id,
+                notice_type=notice_type, signal=signal
+            ))
+        created.extend(_bulk_create_observed_items(observed_items))
+    return created
+
+
+def observe_objects(observed_objects, observer, notice_type_label, signal="post_save"):
+    """
+    Registers one user as observer of many objects.
+
+    Objects which the user is not allowed to view, or already observes,
+    are skipped. Returns the list of created ObservedItems.
+    """
+    if not observer.is_authenticated():
+        raise PermissionDenied()
+    notice_type = NoticeType.objects.get(label=notice_type_label)
+    created = []
+    for content_type, objects in _group_by_content_type(observed_objects):
+        perm = permission_by_label(objects[0], 'view')
+        for objects_part in _chunked(objects, BULK_SIZE):
+            objects_part = filter_objects_with_perm(observer, perm, objects_part)
+            existing = set(ObservedItem.objects.filter_for(
+                content_type, [obj.pk for obj in objects_part],
+                signal=signal, user=observer
+            ).values_list("object_id", flat=True))
+            observed_items = []
+            for obj in objects_part:
+                object_id = str(obj.pk)
+                if object_id in existing:
+                    continue
+                existing.add(object_id)
+                observed_items.append(ObservedItem(
+                    user=observer, content_type=content_type, object_id=object_id,
+                    notice_type=notice_type, signal=signal
+                ))
+            created.extend(_bulk_create_observed_items(observed_items))
+    return created
+
+
+def stop_observing_many(observed, observers, signal="post_save"):
+    """
+    Removes many users as observers of one object.
+    """
+    content_type = ContentType.objects.get_for_model(observed)
+    for observers_part in _chunked(observers, BULK_SIZE):
+        _delete_observed_items(ObservedItem.objects.filter_for(
+            content_type, [observed.pk], signal=signal,
+            user__in=[observer.pk for observer in observers_part]
+        ))
+
+
+def stop_observing_objects(observed_objects, observer, signal="post_save"):
+    """
+    Removes one user as observer of many objects.
+    """
+    for content_type, objects in _group_by_content_type(observed_objects):
+        for objects_part in _chunked(objects, BULK_SIZE):
+            _delete_observed_items(ObservedItem.objects.filter_for(
+                content_type, [obj.pk for obj in objects_part],
+                signal=signal, user=observer
+            ))
+
+
+def stop_observing_all(observer, signal=None):
+    """
+    Removes one user as observer of all objects, for all signals
+    unless a signal is given.
+    """
+    observed_items = ObservedItem.objects.filter(user=observer)
+    if signal is not None:
+        observed_items = observed_items.filter(signal=signal)
+    _delete_observed_items(observed_items)
+
+
+def _bulk_create_observed_items(observed_items):
+    if not observed_items:
+        return observed_items
+    for item in observed_items:
+        item.object_int_id = to_int_object_id(item.object_id)
+    ObservedItem.objects.bulk_create(observed_items)
+    ObserverCount.objects.add_for(observed_items)
+    # bulk_create() does not send post_save.
+    observation_index.add_many([
+        (item.content_type_id, item.object_id, item.signal)
+        for item in observed_items
+    ])
+    return observed_items
+
+
+def _delete_observed_items(observed_items):
+    """Deletes a QuerySet of ObservedItems, keeping observer counts in sync."""
+    ObserverCount.objects.add_for(observed_items, -1)
+    observed_items.delete()
+
+
+def _group_by_content_type(objects):
+    """Returns a list of (content_type, objects) pairs."""
+    groups = OrderedDict()
+    for obj in objects:
+        content_type = ContentType.objects.get_for_model(obj)
+        groups.setdefault(content_type, []).append(obj)
+    return list(groups.items())
+
+
+def _chunked(items, size):
+    """Yields lists of at most size items."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
 
 def send_observation_notices_for(observed, signal="post_save",
@@ -436,31 +893,67 @@ def send_observation_notices_for(observed, signal="post_save",
     """
     if extra_context is None:
         extra_context = {}
+    if not observation_index.is_observed(observed, signal):
+        return ObservedItem.objects.none()
     observed_items = ObservedItem.objects.all_for(observed, signal)
+    if deferred.defer(observed, signal, extra_context, on_site, sender):
+        return observed_items
+    extra_context.update({'observed': observed, })
+    observers = _iter_observers(observed_items, RECIPIENTS_PER_BATCH)
     if QUEUE_ALL:
-        rows = observed_items.values("user", "notice_type__label")
-        extra_context.update({'observed': observed, })
-        notices = []
-        label_users = {}
-        for row in rows:
-            users = label_users.setdefault(row["notice_type__label"], [])
-            users.append(row["user"])
-        for label, users in label_users.items():
-            notices.append((users, label, extra_context, on_site, sender))
-        if notices:
-            NoticeQueueBatch(
-                pickled_data=pickle.dumps(notices).encode("base64")
-            ).save()
+        # One bounded batch per chunk, so that large fan-outs can be
+        # shared by workers and are never held in memory at once.
+        for label, users in observers:
+            queue(users, label, extra_context, on_site, sender)
 
     else:
-        for observed_item in observed_items:
-            observed_item.send_notice(extra_context)
+        # One send per notice type, with the already loaded observed object.
+        for label, users in observers:
+            send_now(User.objects.filter(pk__in=users), label,
+                     extra_context, on_site, sender)
     return observed_items
 
 
-def is_observing(observed, observer, signal="post_save"):
+def _iter_observers(observed_items, chunk_size):
+    """
+    Yields ``(label, user_ids)`` pairs for the given ObservedItems, with at
+    most chunk_size users in each pair.
+
+    Rows are read from the database chunk_size at a time.
+    """
+    label_users = {}
+    last_pk = 0
+    while True:
+        rows = list(observed_items.filter(pk__gt=last_pk).order_by("pk").values_list(
+            "pk", "user", "notice_type__label")[:chunk_size])
+        if not rows:
+            break
+        last_pk = rows[-1][0]
+        for pk, user, label in rows:
+            users = label_users.setdefault(label, [])
+            users.append(user)
+            if len(users) >= chunk_size:
+                yield label, users
+                label_users[label] = []
+    for label, users in label_users.items():
+        if users:
+            yield label, users
+
+
+def is_observing(observed, observer, signal="post_save", observations=None):
+    """
+    Returns True if observer observes the object.
+
+    ``observations`` is an optional map returned by ``prefetch_observations``,
+    it is used instead of a query when it contains the object.
+    """
     if not observer.is_authenticated():
         return False
+    if observations:
+        content_type = ContentType.objects.get_for_model(observed)
+        key = (content_type.pk, str(observed.pk), signal)
+        if key in observations:
+            return observations[key]
     try:
         observed_items = ObservedItem.objects.get_for(observed, observer, signal)
         return True
@@ -470,6 +963,39 @@ def is_observing(observed, observer, signal="post_save"):
         return True
 
 
+def prefetch_observations(objects, observer, signal="post_save", observations=None):
+    """
+    Loads the observation state of observer for all given objects,
+    with one query per content type.
+
+    Returns a dict keyed by ``(content_type_id, object_id, signal)``,
+    which can be passed to ``is_observing``. If ``observations`` is given,
+    it is updated and returned.
+    """
+    if observations is None:
+        observations = {}
+    if not observer.is_authenticated():
+        return observations
+    by_content_type = {}
+    for obj in objects:
+        content_type = ContentType.objects.get_for_model(obj)
+        by_content_type.setdefault(content_type, set()).add(str(obj.pk))
+    for content_type, object_ids in by_content_type.items():
+        observed_ids = set(ObservedItem.objects.filter_for(
+            content_type, list(object_ids), user=observer, signal=signal
+        ).values_list("object_id", flat=True))
+        for object_id in object_ids:
+            observations[(content_type.pk, object_id, signal)] = object_id in observed_ids
+    return observations
+
+
+def _observed_item_saved(sender, instance, created, **kwargs):
+    if created:
+        observation_index.add(instance.content_type_id, instance.object_id, instance.signal)
+
+models.signals.post_save.connect(_observed_item_saved, sender=ObservedItem)
+
+
 # Use carring to pass parameters (context_object, etc.)
 def handle_observations(sender, instance, *args, **kw):
     send_observation_notices_for(instance)
@@ -503,28 +1029,77 @@ class QueryData(models.Model):
             lambda: "#"
         )()
 
+    def __init__(self, *args, **kwargs):
+        super(QueryData, self).__init__(*args, **kwargs)
+        # The terms of a loaded row match its data.
+        self._indexed_source = self._index_source() if self.pk else None
+
+    def _index_source(self):
+        return (self.handler, self.hash, self.pickled_data)
+
+    def save(self, *args, **kwargs):
+        super(QueryData, self).save(*args, **kwargs)
+        # Re-index only if the handler or the data changed.
+        source = self._index_source()
+        if source != self._indexed_source:
+            from notification.matching import index_query_data
+            index_query_data([self])
+            self._indexed_source = source
+
     @property
     def data(self):
         """Gets data"""
-        return pickle.loads(str(self.pickled_data).decode("base64"))
+        # Decoded once per value of pickled_data.
+        if getattr(self, "_data_source", None) != self.pickled_data:
+            self._data = loads_data(self.pickled_data)
+            self._data_source = self.pickled_data
+        return self._data
 
     @data.setter
     def data(self, data):
         """Sets data"""
-        self.pickled_data = pickle.dumps(data).encode("base64")
+        self.pickled_data = dumps_data(data)
         self.hash = QueryData.objects.make_hash(data)
 
     @property
     def handler_instance(self):
         """Returns handler instance."""
-        mod_name, obj_name = self.handler.rsplit('.', 1)
-        __import__(mod_name)
-        mod = sys.modules[mod_name]
-        handler = getattr(mod, obj_name)
-        # In simplest case, handler can be a dict.
-        obj = handler(self.data)
-        obj.is_valid()
-        return obj
+        # Built once per handler and data.
+        source = (self.handler, self.pickled_data)
+        if getattr(self, "_handler_source", None) != source:
+            handler = get_handler_class(self.handler)
+            # In simplest case, handler can be a dict.
+            obj = handler(self.data)
+            obj.is_valid()
+            self._handler_instance = obj
+            self._handler_source = source
+        return self._handler_instance
+
+
+class QueryDataTerm(models.Model):
+    """
+    A (field, value) pair of QueryData, to find the saved searches
+    which can match an object. See notification.matching.
+    """
+    query_data = models.ForeignKey(QueryData, related_name="terms")
+    field = models.CharField(max_length=100)
+    value = models.CharField(max_length=255)
+
+    class Meta:
+        index_together = [("field", "value")]
+
+
+_handler_classes = {}
+
+
+def get_handler_class(path):
+    """Returns the QueryData handler for a dotted path, imported once."""
+    try:
+        return _handler_classes[path]
+    except KeyError:
+        mod_name, obj_name = path.rsplit('.', 1)
+        handler = _handler_classes[path] = getattr(import_module(mod_name), obj_name)
+        return handler
 
 # Python 2.* compatible
 try:
@@ -0,0 +1,426 @@
+from __future__ import absolute_import, unicode_literals
+import base64
+import calendar
+import heapq
+import itertools
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from django.conf import settings
+from django.core import exceptions
+from django.utils import timezone
+from django.utils.importlib import import_module
+
+# the storage of queued notices, see get_queue_storage()
+QUEUE_STORAGE = getattr(settings, "NOTIFICATION_QUEUE_STORAGE",
+                        "notification.queues.DatabaseQueueStorage")
+# keyword arguments of the storage class
+QUEUE_STORAGE_OPTIONS = getattr(settings, "NOTIFICATION_QUEUE_STORAGE_OPTIONS", {})
+# seconds a claimed batch is hidden from other consumers before it is due
+# again, if it was neither acked, retried nor renewed
+CLAIM_LEASE = getattr(settings, "NOTIFICATION_QUEUE_CLAIM_LEASE", 300)
+
+
+class QueuedBatch(object):
+    """
+    A queued batch of notices. notices is a list of
+    (users, label, extra_context, on_site, sender) tuples.
+    """
+
+    def __init__(self, id, notices, priority=0, expires=None, not_before=None):
+        self.id = id
+        self.notices = notices
+        self.priority = priority
+        self.expires = expires
+        self.not_before = not_before
+
+    def __repr__(self):
+        return "<QueuedBatch: {0} (priority {1})>".format(self.id, self.priority)
+
+
+class BaseQueueStorage(object):
+    """
+    The storage of queued notices.
+
+    Batches are claimed by lane (priority): a claimed batch is not due
+    anymore until the lease expires, and must be acked once sent, or
+    retried. A consumer renews the lease while sending a batch; if it
+    does not in time, another consumer can claim and send the batch again,
+    so delivery is at least once. All times are datetimes as returned by
+    timezone.now().
+    """
+
+    def enqueue(self, batches, priority=0, expires=None, not_before=None):
+        """
+        Queues the given batches, each a list of notices.
+        Returns the number of queued batches.
+        """
+        raise NotImplementedError()
+
+    def lanes(self, now=None):
+        """Returns the priorities of the due batches, higher first."""
+        raise NotImplementedError()
+
+    def claim(self, priority, limit, now=None, lease=CLAIM_LEASE):
+        """
+        Claims up to limit due batches of a lane, the oldest first.
+        Returns a list of QueuedBatch.
+        """
+        raise NotImplementedError()
+
+    def ack(self, batch):
+        """Removes a sent batch."""
+        raise NotImplementedError()
+
+    def retry(self, batch, delay=0):
+        """Makes a claimed batch due again after delay seconds."""
+        raise NotImplementedError()
+
+    def renew(self, batch, lease=CLAIM_LEASE):
+        """Extends the lease of a claimed batch to lease seconds from now."""
+        self.retry(batch, lease)
+
+    def depth(self):
+        """Returns the number of queued batches."""
+        raise NotImplementedError()
+
+    def next_due(self):
+        """Returns the time the next batch is due, None if the queue is empty."""
+        raise NotImplementedError()
+
+    def shed(self, max_priority, now=None):
+        """
+        Removes the expired batches of lanes up to max_priority.
+        Returns the number of removed batches.
+        """
+        raise NotImplementedError()
+
+
+class DatabaseQueueStorage(BaseQueueStorage):
+    """The NoticeQueueBatch table of the default database."""
+
+    def enqueue(self, batches, priority=0, expires=None, not_before=None):
+        from notification.models import NoticeQueueBatch
+        if not_before is None:
+            not_before = timezone.now()
+        rows = [
+            NoticeQueueBatch(
+                pickled_data=base64.b64encode(pickle.dumps(notices)).decode("ascii"),
+                priority=priority,
+                expires=expires,
+                not_before=not_before,
+            )
+            for notices in batches
+        ]
+        NoticeQueueBatch.objects.bulk_create(rows)
+        return len(rows)
+
+    def lanes(self, now=None):
+        from notification.models import NoticeQueueBatch
+        return list(NoticeQueueBatch.objects.filter(
+            not_before__lte=now or timezone.now()
+        ).order_by("-priority").values_list("priority", flat=True).distinct())
+
+    def claim(self, priority, limit, now=None, lease=CLAIM_LEASE):
+        from notification.models import NoticeQueueBatch
+        now = now or timezone.now()
+        rows = NoticeQueueBatch.objects.filter(
+            priority=priority, not_before__lte=now
+        ).order_by("not_before", "pk")[:limit]
+        claimed = []
+        for row in rows:
+            # Only one consumer updates the row from its not_before.
+            if NoticeQueueBatch.objects.filter(pk=row.pk, not_before=row.not_before).update(
+                not_before=now + timedelta(seconds=lease)
+            ):
+                claimed.append(QueuedBatch(
+                    row.pk, pickle.loads(base64.b64decode(row.pickled_data)),
+                    row.priority, row.expires, row.not_before,
+                ))
+        return claimed
+
+    def ack(self, batch):
+        from notification.models import NoticeQueueBatch
+        NoticeQueueBatch.objects.filter(pk=batch.id).delete()
+
+    def retry(self, batch, delay=0):
+        from notification.models import NoticeQueueBatch
+        NoticeQueueBatch.objects.filter(pk=batch.id).update(
+            not_before=timezone.now() + timedelta(seconds=delay)
+        )
+
+    def depth(self):
+        from notification.models import NoticeQueueBatch
+        return NoticeQueueBatch.objects.count()
+
+    def next_due(self):
+        from notification.models import NoticeQueueBatch
+        not_befores = NoticeQueueBatch.objects.order_by("not_before").values_list(
+            "not_before", flat=True
+        )[:1]
+        return not_befores[0] if not_befores else None
+
+    def shed(self, max_priority, now=None):
+        from notification.models import NoticeQueueBatch
+        expired = NoticeQueueBatch.objects.filter(
+            priority__lte=max_priority, expires__lte=now or timezone.now()
+        )
+        shed = expired.count()
+        if shed:
+            expired.delete()
+        return shed
+
+
+class MemoryQueueStorage(BaseQueueStorage):
+    """
+    A queue in the memory of the process, for tests and benchmarks.
+    Batches are pickled, as they would be by the other storages.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        # id -> [priority, not_before, expires, pickled notices]
+        self._batches = {}
+        # priority -> heap of (not_before, id), with stale entries
+        self._lanes = {}
+
+    def _push(self, batch_id, priority, not_before):
+        heapq.heappush(self._lanes.setdefault(priority, []), (not_before, batch_id))
+
+    def enqueue(self, batches, priority=0, expires=None, not_before=None):
+        if not_before is None:
+            not_before = timezone.now()
+        count = 0
+        with self._lock:
+            for notices in batches:
+                batch_id = next(self._ids)
+                self._batches[batch_id] = [priority, not_before, expires, pickle.dumps(notices)]
+                self._push(batch_id, priority, not_before)
+                count += 1
+        return count
+
+    def _is_current(self, batch_id, not_before):
+        batch = self._batches.get(batch_id)
+        return batch is not None and batch[1] == not_before
+
+    def lanes(self, now=None):
+        now = now or timezone.now()
+        with self._lock:
+            lanes = []
+            for priority, heap in self._lanes.items():
+                # Drop the stale entries at the top of the heap.
+                while heap and not self._is_current(heap[0][1], heap[0][0]):
+                    heapq.heappop(heap)
+                if heap and heap[0][0] <= now:
+                    lanes.append(priority)
+        return sorted(lanes, reverse=True)
+
+    def claim(self, priority, limit, now=None, lease=CLAIM_LEASE):
+        now = now or timezone.now()
+        until = now + timedelta(seconds=lease)
+        claimed = []
+        with self._lock:
+            heap = self._lanes.get(priority, [])
+            while heap and len(claimed) < limit and heap[0][0] <= now:
+                not_before, batch_id = heapq.heappop(heap)
+                if not self._is_current(batch_id, not_before):
+                    continue
+                batch = self._batches[batch_id]
+                batch[1] = until
+                self._push(batch_id, priority, until)
+                claimed.append(QueuedBatch(
+                    batch_id, pickle.loads(batch[3]), priority, batch[2], not_before,
+                ))
+        return claimed
+
+    def ack(self, batch):
+        with self._lock:
+            self._batches.pop(batch.id, None)
+
+    def retry(self, batch, delay=0):
+        not_before = timezone.now() + timedelta(seconds=delay)
+        with self._lock:
+            if batch.id in self._batches:
+                self._batches[batch.id][1] = not_before
+                self._push(batch.id, batch.priority, not_before)
+
+    def depth(self):
+        return len(self._batches)
+
+    def next_due(self):
+        with self._lock:
+            not_befores = [batch[1] for batch in self._batches.values()]
+        return min(not_befores) if not_befores else None
+
+    def shed(self, max_priority, now=None):
+        now = now or timezone.now()
+        with self._lock:
+            expired = [
+                batch_id for batch_id, (priority, not_before, expires, data) in self._batches.items()
+                if priority <= max_priority and expires is not None and expires <= now
+            ]
+            for batch_id in expired:
+                del self._batches[batch_id]
+        return len(expired)
+
+
+class SQLiteQueueStorage(BaseQueueStorage):
+    """
+    A queue in a local SQLite file in WAL mode, for single host deployments.
+    Processes of the host can share the file; claims are serialized by
+    SQLite write transactions.
+    """
+
+    def __init__(self, path="notification_queue.sqlite3", timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        # sqlite3 connections cannot be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS notice_queue ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "priority INTEGER NOT NULL, "
+                "not_before REAL NOT NULL, "
+                "expires REAL, "
+                "data BLOB NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS notice_queue_lane "
+                "ON notice_queue (priority, not_before)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS notice_queue_not_before "
+                "ON notice_queue (not_before)"
+            )
+            self._local.connection = connection
+        return connection
+
+    def _to_timestamp(self, value):
+        if value is None:
+            return None
+        if timezone.is_aware(value):
+            return calendar.timegm(value.utctimetuple()) + value.microsecond / 1e6
+        return time.mktime(value.timetuple()) + value.microsecond / 1e6
+
+    def _to_datetime(self, value):
+        if value is None:
+            return None
+        if getattr(settings, "USE_TZ", False):
+            return datetime.fromtimestamp(value, timezone.utc)
+        return datetime.fromtimestamp(value)
+
+    def enqueue(self, batches, priority=0, expires=None, not_before=None):
+        not_before = self._to_timestamp(not_before or timezone.now())
+        expires = self._to_timestamp(expires)
+        rows = [
+            (priority, not_before, expires, sqlite3.Binary(pickle.dumps(notices)))
+            for notices in batches
+        ]
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "INSERT INTO notice_queue (priority, not_before, expires, data) VALUES (?, ?, ?, ?)",
+                rows
+            )
+        except:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return len(rows)
+
+    def lanes(self, now=None):
+        rows = self.connection.execute(
+            "SELECT DISTINCT priority FROM notice_queue WHERE not_before <= ? ORDER BY priority DESC",
+            (self._to_timestamp(now or timezone.now()), )
+        )
+        return [priority for priority, in rows]
+
+    def claim(self, priority, limit, now=None, lease=CLAIM_LEASE):
+        now = self._to_timestamp(now or timezone.now())
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            rows = connection.execute(
+                "SELECT id, priority, not_before, expires, data FROM notice_queue "
+                "WHERE priority = ? AND not_before <= ? ORDER BY not_before, id LIMIT ?",
+                (priority, now, limit)
+            ).fetchall()
+            connection.executemany(
+                "UPDATE notice_queue SET not_before = ? WHERE id = ?",
+                [(now + lease, row[0]) for row in rows]
+            )
+        except:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return [
+            QueuedBatch(batch_id, pickle.loads(bytes(data)), priority,
+                        self._to_datetime(expires), self._to_datetime(not_before))
+            for batch_id, priority, not_before, expires, data in rows
+        ]
+
+    def ack(self, batch):
+        self.connection.execute("DELETE FROM notice_queue WHERE id = ?", (batch.id, ))
+
+    def retry(self, batch, delay=0):
+        self.connection.execute(
+            "UPDATE notice_queue SET not_before = ? WHERE id = ?",
+            (self._to_timestamp(timezone.now()) + delay, batch.id)
+        )
+
+    def depth(self):
+        return self.connection.execute("SELECT COUNT(*) FROM notice_queue").fetchone()[0]
+
+    def next_due(self):
+        value = self.connection.execute("SELECT MIN(not_before) FROM notice_queue").fetchone()[0]
+        return self._to_datetime(value)
+
+    def shed(self, max_priority, now=None):
+        cursor = self.connection.execute(
+            "DELETE FROM notice_queue WHERE priority <= ? AND expires IS NOT NULL AND expires <= ?",
+            (max_priority, self._to_timestamp(now or timezone.now()))
+        )
+        return cursor.rowcount
+
+
+_storage = None
+
+
+def load_queue_storage(path, options=None):
+    """Returns an instance of the storage class at the dotted path."""
+    dot = path.rindex(".")
+    module_path, class_name = path[:dot], path[dot+1:]
+    try:
+        module = import_module(module_path)
+    except ImportError as e:
+        raise exceptions.ImproperlyConfigured('Error importing notification queue storage {0}: "{1}"'.format(module_path, e))
+    try:
+        storage_class = getattr(module, class_name)
+    except AttributeError:
+        raise exceptions.ImproperlyConfigured('Notification queue storage module "{0}" does not define "{1}"'.format(module_path, class_name))
+    return storage_class(**(options or {}))
+
+
+def get_queue_storage():
+    """Returns the storage of the NOTIFICATION_QUEUE_STORAGE setting."""
+    global _storage
+    if _storage is None:
+        _storage = load_queue_storage(QUEUE_STORAGE, QUEUE_STORAGE_OPTIONS)
+    return _storage
@@ -13,3 +13,32 @@ delivered = django.dispatch.Signal(providing_args=[
     "recipient", "notice_type", "extra_context", "sender_user",
     "medium_id", "backend_label", "backend",
 ])
+
+# Batch variants, sent once per send_now() call (or once per backend and
+# group of recipients for delivered_many) with the list of recipients.
+# should_deliver_many receivers return a dict of recipient pk to a boolean,
+# recipients missing from it are delivered. configure_many receivers return
+# a dict of recipient pk to a config dict.
+should_deliver_many = django.dispatch.Signal(providing_args=[
+    "recipients", "label", "notice_type",
+    "extra_context", "sender_user",
+])
+configure_many = django.dispatch.Signal(providing_args=[
+    "recipients", "label", "notice_type",
+    "extra_context", "sender_user",
+])
+delivered_many = django.dispatch.Signal(providing_args=[
+    "recipients", "notice_type", "extra_context", "sender_user",
+    "medium_id", "backend_label", "backend",
+])
+
+
+def has_receivers(signal, sender):
+    """
+    Returns False if no live receiver of signal accepts sender, to skip
+    building its arguments. Always True before Django 1.6, which has no
+    public way to tell.
+    """
+    if hasattr(signal, "has_listeners"):
+        return signal.has_listeners(sender)
+    return True
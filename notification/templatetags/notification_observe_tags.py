@@ -9,8 +9,8 @@ from django.contrib.contenttypes.models import ContentType
 from classytags.core import Tag, Options
 from classytags.arguments import Argument, KeywordArgument, MultiKeywordArgument
 
-from notification.models import is_observing, ObservedItem
-from notification.utils import permission_by_label
+from notification.models import is_observing, prefetch_observations, ObservedItem
+from notification.utils import permission_by_label, get_request_observations
 
 register = template.Library()
 
@@ -35,13 +35,15 @@ class ObserveLinkTag(Tag):
         observer = context['request'].user
         content_type = ContentType.objects.get_for_model(obj)
         observed = False
-        if is_observing(observed=obj, observer=observer, signal=signal):
+        observations = get_request_observations(context['request'])
+        if is_observing(observed=obj, observer=observer, signal=signal,
+                        observations=observations):
             observed = True
 
         result = ''
         perm = permission_by_label(obj, 'view')
         allowed = observer.is_authenticated() and (
-            observer.has_perm(perm, obj) or observed  # Can stop oserving for closed observed object
+            observed or observer.has_perm(perm, obj)  # Can stop oserving for closed observed object
         )
 
         if allowed:
@@ -65,3 +67,27 @@ class ObserveLinkTag(Tag):
         return result
 
 register.tag(ObserveLinkTag)
+
+
+class PrefetchObservationsTag(Tag):
+    """
+    Loads observation state for a list of objects, so that following
+    ``observe_link`` tags do not query it for each object.
+
+    Usage::
+
+        {% prefetch_observations object_list "post_save" %}
+    """
+    name = 'prefetch_observations'
+    options = Options(
+        Argument('objects', required=True),
+        Argument('signal', required=False, default='post_save'),
+    )
+
+    def render_tag(self, context, objects, signal):
+        request = context['request']
+        prefetch_observations(objects, request.user, signal,
+                              get_request_observations(request))
+        return ''
+
+register.tag(PrefetchObservationsTag)
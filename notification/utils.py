@@ -1,4 +1,19 @@
 from __future__ import absolute_import, unicode_literals
+import json
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    string_types = (basestring,)
+    integer_types = (int, long)
+except NameError:
+    string_types = (str,)
+    integer_types = (int,)
+
+SET_TAG = "__set__"
 
 
 def permission_by_label(model, label):
@@ -13,3 +28,124 @@ def permission_by_label(model, label):
         mod=model._meta.module_name
     )
     return permission_code
+
+
+def filter_users_with_perm(users, perm, obj):
+    """Returns the active users, among the given ones, having perm on obj.
+
+    Works like ``user.has_perm(perm, obj)`` for each user, but an
+    authentication backend defining ``filter_users_with_perm(users, perm,
+    obj)``, returning the allowed users, answers for the whole batch at once.
+    """
+    from django.contrib.auth import get_backends
+    pending = []
+    allowed = []
+    for user in users:
+        if not user.is_active:
+            continue
+        (allowed if user.is_superuser else pending).append(user)
+    for backend in get_backends():
+        if not pending:
+            break
+        if hasattr(backend, "filter_users_with_perm"):
+            granted = set(u.pk for u in backend.filter_users_with_perm(pending, perm, obj))
+        elif hasattr(backend, "has_perm"):
+            granted = set(u.pk for u in pending if backend.has_perm(u, perm, obj))
+        else:
+            continue
+        allowed.extend(u for u in pending if u.pk in granted)
+        pending = [u for u in pending if u.pk not in granted]
+    return allowed
+
+
+def filter_objects_with_perm(user, perm, objects):
+    """Returns the objects, among the given ones, on which user has perm.
+
+    Works like ``user.has_perm(perm, obj)`` for each object, but an
+    authentication backend defining ``filter_objects_with_perm(user, perm,
+    objects)``, returning the allowed objects, answers for the whole batch
+    at once.
+    """
+    from django.contrib.auth import get_backends
+    if not user.is_active:
+        return []
+    if user.is_superuser:
+        return list(objects)
+    pending = list(objects)
+    allowed = []
+    for backend in get_backends():
+        if not pending:
+            break
+        if hasattr(backend, "filter_objects_with_perm"):
+            granted = set(id(obj) for obj in backend.filter_objects_with_perm(user, perm, pending))
+        elif hasattr(backend, "has_perm"):
+            granted = set(id(obj) for obj in pending if backend.has_perm(user, perm, obj))
+        else:
+            continue
+        allowed.extend(obj for obj in pending if id(obj) in granted)
+        pending = [obj for obj in pending if id(obj) not in granted]
+    return allowed
+
+
+def get_request_observations(request):
+    """Returns the request-scoped map of prefetched observation state.
+
+    See ``notification.models.prefetch_observations``.
+    """
+    try:
+        return request._notification_observations
+    except AttributeError:
+        request._notification_observations = {}
+        return request._notification_observations
+
+
+def _to_json(obj):
+    if isinstance(obj, (tuple, list)):
+        return [_to_json(v) for v in obj]
+    if isinstance(obj, (set, frozenset)):
+        return {SET_TAG: [_to_json(v) for v in obj]}
+    if isinstance(obj, dict):
+        if list(obj.keys()) == [SET_TAG]:
+            raise TypeError("Ambiguous key {0}".format(SET_TAG))
+        new_obj = {}
+        for k, v in obj.items():
+            if not isinstance(k, string_types):
+                raise TypeError("Not a string key {0!r}".format(k))
+            new_obj[k] = _to_json(v)
+        return new_obj
+    if obj is None or isinstance(obj, string_types + integer_types + (float, )):
+        return obj
+    raise TypeError("Not JSON serializable {0!r}".format(obj))
+
+
+def _from_json(obj):
+    if isinstance(obj, list):
+        return tuple(_from_json(v) for v in obj)
+    if isinstance(obj, dict):
+        if list(obj.keys()) == [SET_TAG]:
+            return frozenset(_from_json(v) for v in obj[SET_TAG])
+        return dict((k, _from_json(v)) for k, v in obj.items())
+    return obj
+
+
+def dumps_data(data):
+    """Serializes query data, see QueryData.
+
+    Data made of dicts, sequences, sets and scalars is stored as compact JSON
+    (sequences are loaded back as tuples, sets as frozensets), anything else
+    is pickled.
+    """
+    if isinstance(data, (dict, tuple, list, set, frozenset)):
+        try:
+            return json.dumps(_to_json(data), sort_keys=True, separators=(",", ":"))
+        except (TypeError, ValueError):
+            pass
+    return pickle.dumps(data).encode("base64")
+
+
+def loads_data(text):
+    """Deserializes query data serialized by dumps_data."""
+    if text[:1] in ("{", "["):
+        return _from_json(json.loads(text))
+    # Pickled, base64 never starts with a bracket.
+    return pickle.loads(str(text).decode("base64"))
@@ -5,6 +5,7 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.syndication.views import feed
+from django.core.paginator import Paginator, InvalidPage
 from django.core.urlresolvers import reverse
 from django.core import signing
 from django.http import HttpResponseRedirect, Http404, HttpResponse
@@ -16,9 +17,11 @@ from notification.models import (NOTICE_MEDIA, Notice, NoticeType,
     NoticeSetting, ObservedItem, is_observing, observe, stop_observing,
     get_notification_setting)
 from notification.decorators import basic_auth_required, simple_basic_auth_callback
+from notification.utils import get_request_observations
 from notification.feeds import NoticeUserFeed
 
 UNSUBSCRIBE_TIMEOUT = getattr(settings, "NOTIFICATION_UNSUBSCRIBE_TIMEOUT", 2*24*3600)
+OBSERVED_PER_PAGE = getattr(settings, "NOTIFICATION_OBSERVED_PER_PAGE", 20)
 
 @basic_auth_required(realm="Notices Feed", callback_func=simple_basic_auth_callback)
 def feed_for_user(request):
@@ -65,18 +68,42 @@ def observe_toggle(request, content_type_id, object_id,
 
 @login_required
 def observed_list(request):
-    """List of observed objects view."""
-    object_list = ObservedItem.objects.filter(
+    """
+    List of observed objects view.
+
+    Observed objects of the current page are fetched with one query per
+    content type. Items of removed objects are skipped here and deleted
+    by the ``prune_observed_items`` management command.
+
+    Template: :template:`notification/observed_list.html`
+
+    Context:
+
+        object_list
+            A list of :model:`notification.ObservedItem` objects of the
+            current page.
+
+        page_obj, paginator, is_paginated
+            The pagination state.
+    """
+    queryset = ObservedItem.objects.filter(
         user=request.user
-    ).order_by("-added")
+    ).select_related("notice_type").order_by("-added")
+    paginator = Paginator(queryset, OBSERVED_PER_PAGE)
+    try:
+        page_obj = paginator.page(request.GET.get("page", 1))
+    except InvalidPage:
+        raise Http404
+    object_list = ObservedItem.objects.fetch_observed_objects(page_obj.object_list)
+    # All listed objects are observed, let observe_link tags know it.
+    observations = get_request_observations(request)
     for item in object_list:
-        if not item.observed_object:
-            item.delete()
-    object_list = ObservedItem.objects.filter(
-        user=request.user
-    ).order_by("-added")
+        observations[(item.content_type_id, item.object_id, item.signal)] = True
     return render_to_response("notification/observed_list.html", {
         "object_list": object_list,
+        "page_obj": page_obj,
+        "paginator": paginator,
+        "is_paginated": page_obj.has_other_pages(),
     }, context_instance=RequestContext(request))
 
 